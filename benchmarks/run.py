@@ -0,0 +1,373 @@
+"""
+This module runs the offline benchmarks of spotiscience against the local Spotify and Genius stand-in
+Every case runs in a fresh process, so the peak memory of a case is not mixed with the others
+
+usage:
+python -m benchmarks.run                                  # every case with the default sizes
+python -m benchmarks.run --cases get_song_features,predict_similar_songs --sizes 1000,100000
+python -m benchmarks.run --latency 0.05 --rate-limit-every 20 --workers 8 --json results.json
+
+Author: Cristóbal Veas
+Linkedln: https://www.linkedin.com/in/cristobal-veas/
+"""
+
+__author__ = "Cristóbal Veas"
+__email__ = "cristobal.veas.ch@gmail.com"
+__status__ = "planning"
+
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import warnings
+import numpy as np
+import requests
+
+from benchmarks.stub_server import StubServer, SONGS_PER_ALBUM, ALBUMS_PER_ARTIST, track_id, artist_id, playlist_id
+
+CREDENTIALS = {'client_id':'stub-client-id','client_secret':'stub-client-secret','redirect_url':'http://127.0.0.1:8080',
+               'user_id':'stub-user','genius_access_token':'stub-genius-token'}
+
+WORDS = ['love','night','baby','heart','dance','light','time','feel','never','world','dream','fire','away','tonight','blinding',
+         'summer','rain','city','lonely','forever','money','party','road','home','sky','cold','tears','free','young','gold']
+
+# latencies (seconds) of the http requests made by the spotify and genius clients of the case
+LATENCIES = []
+
+
+def _record_latency(response,*args,**kwargs):
+    LATENCIES.append(response.elapsed.total_seconds())
+
+
+def point_clients_to(url):
+    """
+    Point spotipy and lyricsgenius to the stand-in served at url
+    The downloader creates its clients through the spotipy and lyricsgenius modules, so the clients are replaced there
+    """
+    import spotipy
+    import lyricsgenius
+    from spotipy.oauth2 import SpotifyClientCredentials, SpotifyOAuth
+
+    SpotifyClientCredentials.OAUTH_TOKEN_URL = f"{url}/api/token"
+    SpotifyOAuth.OAUTH_TOKEN_URL = f"{url}/api/token"
+
+    class StubSpotify(spotipy.Spotify):
+        def __init__(self,*args,**kwargs):
+            super().__init__(*args,**kwargs)
+            self.prefix = f"{url}/v1/"
+            if _record_latency not in self._session.hooks['response']:
+                self._session.hooks['response'].append(_record_latency)
+
+    class StubGenius(lyricsgenius.Genius):
+        API_ROOT = f"{url}/genius/v1/"
+        PUBLIC_API_ROOT = f"{url}/genius/api/"
+        WEB_ROOT = f"{url}/genius/"
+
+        def __init__(self,*args,**kwargs):
+            super().__init__(*args,**kwargs)
+            self._session.hooks['response'].append(_record_latency)
+
+    spotipy.Spotify = StubSpotify
+    lyricsgenius.Genius = StubGenius
+
+
+def seed_user_token(cache_path,scope):
+    """
+    Write a valid token of a user scope to the token cache, so the oauth flow does not ask for the user authorization
+    """
+    token = {'access_token':'stub-access-token','token_type':'Bearer','expires_in':3600,'scope':scope,
+             'expires_at':int(time.time())+24*3600,'refresh_token':'stub-refresh-token'}
+    with open(f"{cache_path}-{scope}",'w') as f:
+        json.dump(token,f)
+
+
+def percentile(values,q):
+    """
+    Return the q percentile of the values in milliseconds (None if there are no values)
+    """
+    return float(np.percentile(values,q)*1000) if len(values) else None
+
+
+def synthetic_songs(n_songs,seed=0):
+    """
+    Return a songs table with n_songs random songs (same columns and types as the downloader tables)
+    """
+    import pandas as pd
+    from spotiscience.features import SONG_KEYS, SONG_DTYPES
+
+    rng = np.random.default_rng(seed)
+    columns = {
+        'id':[track_id(n) for n in range(n_songs)],
+        'name':[f"Song {n}" for n in range(n_songs)],
+        'artist':[f"Artist {n // SONGS_PER_ALBUM // ALBUMS_PER_ARTIST}" for n in range(n_songs)],
+        'album':[f"Album {n // SONGS_PER_ALBUM}" for n in range(n_songs)],
+        'release_date':rng.choice(['2019-01-01','2020-03-20','2021-06-11'],n_songs),
+        'popularity':rng.integers(0,100,n_songs),
+        'length':rng.integers(120000,360000,n_songs),
+        'loudness':-rng.uniform(0,20,n_songs),
+        'tempo':rng.uniform(60,200,n_songs),
+        'key':rng.integers(0,12,n_songs),
+        'time_signature':np.full(n_songs,4),
+        }
+    for key in ['acousticness','danceability','energy','instrumentalness','liveness','valence','speechiness']:
+        columns[key] = rng.random(n_songs)
+    return pd.DataFrame(columns,columns=SONG_KEYS).astype(SONG_DTYPES)
+
+
+def synthetic_lyrics(n_lyrics,seed=0):
+    """
+    Return a list of n_lyrics random lyrics with 4 verses of 4 lines
+    """
+    rng = np.random.default_rng(seed)
+    lyrics = []
+    for _ in range(n_lyrics):
+        lines = [" ".join(rng.choice(WORDS,rng.integers(4,9))).capitalize() for _ in range(16)]
+        lyrics.append("\n".join(lines))
+    return lyrics
+
+
+def mood_model_path(predicter,directory):
+    """
+    Return the path of the mood model, a random forest is trained on random songs when the package has no weights
+    """
+    if os.path.exists(predicter.PATHMODEL):
+        return predicter.PATHMODEL
+    import joblib
+    from sklearn.ensemble import RandomForestClassifier
+    from spotiscience.features import SONG_KEYS, feature_matrix
+
+    songs = synthetic_songs(2000,seed=1)
+    model = RandomForestClassifier(n_estimators=100,random_state=0)
+    model.fit(feature_matrix(songs,SONG_KEYS[6:]),np.random.default_rng(1).integers(0,4,len(songs)))
+    path = os.path.join(directory,'mood.joblib')
+    joblib.dump(model,path)
+    return path
+
+
+#----------------
+#Downloader cases
+#----------------
+
+def _downloader(args,directory):
+    from spotiscience import SpotiScienceDownloader
+
+    cache_path = os.path.join(directory,'token')
+    seed_user_token(cache_path,'playlist-modify-public')
+    return SpotiScienceDownloader(credentials=CREDENTIALS,cache_path=cache_path,max_workers=args.workers,rate_limit=args.rate_limit)
+
+
+def case_get_song_features(args,directory):
+    sd = _downloader(args,directory)
+    for n in range(args.songs):
+        sd.get_song_features(track_id(n))
+    return {'tracks':args.songs}
+
+
+def case_get_albums_song_features(args,directory):
+    sd = _downloader(args,directory)
+    tracks = 0
+    for n in range(args.artists):
+        albums = sd.get_albums_song_features(artist_id(n),is_artist=True)
+        tracks += sum(len(songs) for songs in albums.values())
+    return {'tracks':tracks}
+
+
+def case_get_playlist_song_features(args,directory):
+    sd = _downloader(args,directory)
+    playlist = sd.get_playlist_song_features(playlist_id(args.playlist_songs),n_songs=args.playlist_songs)
+    return {'tracks':sum(len(songs) for songs in playlist.values())}
+
+
+def case_get_song_music_genre(args,directory):
+    sd = _downloader(args,directory)
+    for n in range(args.songs):
+        sd.get_song_music_genre(track_id(n))
+    return {'tracks':args.songs}
+
+
+def case_get_song_lyrics(args,directory):
+    sd = _downloader(args,directory)
+    lyrics = sd.get_songs_lyrics([(f"Song {n}",f"Artist {n // SONGS_PER_ALBUM // ALBUMS_PER_ARTIST}") for n in range(args.lyrics)])
+    return {'tracks':args.lyrics,'found':sum(lyric is not None for lyric in lyrics)}
+
+
+#---------------
+#Predicter cases
+#---------------
+
+def _timed(function,repeat):
+    """
+    Call the function repeat times and return the list of seconds of every call
+    """
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter()-start)
+    return latencies
+
+
+def case_predict_topic_lyric(args,directory):
+    import spacy
+    from spotiscience import SpotiSciencePredicter
+
+    if not spacy.util.is_package(args.spacy_model):
+        return {'skipped':f"spaCy model {args.spacy_model} is not installed"}
+    predicter = SpotiSciencePredicter(english_model=args.spacy_model)
+    lyrics = synthetic_lyrics(args.lyrics)
+    # the first call loads the spaCy pipeline
+    predicter.predict_topic_lyric(lyrics[0])
+    latencies = [_timed(lambda: predicter.predict_topic_lyric(lyric),1)[0] for lyric in lyrics]
+    return {'tracks':len(lyrics),'latencies':latencies}
+
+
+def case_predict_song_mood(args,directory,size):
+    from spotiscience import SpotiSciencePredicter
+
+    predicter = SpotiSciencePredicter()
+    predicter.PATHMODEL = mood_model_path(predicter,directory)
+    songs = synthetic_songs(size)
+    latencies = _timed(lambda: predicter.predict_song_moods(songs),args.repeat)
+    return {'tracks':size*args.repeat,'latencies':latencies}
+
+
+def case_predict_similar_songs(args,directory,size):
+    from spotiscience import SpotiSciencePredicter
+
+    predicter = SpotiSciencePredicter()
+    songs = synthetic_songs(size)
+    queries = synthetic_songs(args.queries,seed=2)
+    latencies = _timed(lambda: predicter.predict_similar_songs(queries,songs),args.repeat)
+    return {'tracks':size*args.repeat,'latencies':latencies}
+
+
+DOWNLOADER_CASES = {
+    'get_song_features':case_get_song_features,
+    'get_albums_song_features':case_get_albums_song_features,
+    'get_playlist_song_features':case_get_playlist_song_features,
+    'get_song_music_genre':case_get_song_music_genre,
+    'get_song_lyrics':case_get_song_lyrics,
+    }
+
+PREDICTER_CASES = {
+    'predict_topic_lyric':case_predict_topic_lyric,
+    }
+
+CATALOG_CASES = {
+    'predict_song_mood':case_predict_song_mood,
+    'predict_similar_songs':case_predict_similar_songs,
+    }
+
+
+def run_case(name,size,args,url):
+    """
+    Run a benchmark case and return a dictionary with its measures, called in a fresh process
+    """
+    point_clients_to(url)
+    # the package is imported before the clock starts, its import time is not part of the case
+    import spotiscience
+    warnings.filterwarnings('ignore',message="A cache_handler has been specified")
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull,'w') as devnull:
+        before = requests.get(f"{url}/_stats").json()
+        start = time.perf_counter()
+        # the downloader prints its progress
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            if name in CATALOG_CASES:
+                result = CATALOG_CASES[name](args,directory,size)
+            else:
+                result = {**DOWNLOADER_CASES,**PREDICTER_CASES}[name](args,directory)
+        finally:
+            sys.stdout = stdout
+        seconds = time.perf_counter()-start
+        after = requests.get(f"{url}/_stats").json()
+
+    if 'skipped' in result:
+        return {'case':name,'size':size,**result}
+
+    api_calls = after['requests']-before['requests']
+    latencies = result.pop('latencies',LATENCIES)
+    return {
+        'case':name,
+        'size':size,
+        **result,
+        'seconds':seconds,
+        'tracks_per_sec':result['tracks']/seconds if seconds else None,
+        'api_calls':api_calls,
+        'api_calls_per_track':api_calls/result['tracks'] if result['tracks'] else None,
+        'rate_limited':after['rate_limited']-before['rate_limited'],
+        'p50_ms':percentile(latencies,50),
+        'p99_ms':percentile(latencies,99),
+        # linux reports the max resident set size in kilobytes
+        'peak_rss_mb':resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024,
+        }
+
+
+def format_row(result):
+    """
+    Return a line of the results table
+    """
+    name = result['case'] if result['size'] is None else f"{result['case']}[{result['size']}]"
+    if 'skipped' in result:
+        return f"{name:<38} skipped: {result['skipped']}"
+
+    def value(key,fmt):
+        return format(result[key],fmt) if result[key] is not None else '-'
+
+    return (f"{name:<38} {value('tracks_per_sec','>12.1f')} {value('api_calls_per_track','>11.3f')} "
+            f"{value('rate_limited','>5d')} {value('p50_ms','>9.2f')} {value('p99_ms','>9.2f')} {value('peak_rss_mb','>9.1f')}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the offline benchmarks of spotiscience")
+    parser.add_argument('--cases',default=None,help="comma separated cases to run (default is every case)")
+    parser.add_argument('--sizes',default='1000,100000,1000000',help="catalog sizes of the predicter cases")
+    parser.add_argument('--songs',type=int,default=200,help="songs requested one by one by the song cases")
+    parser.add_argument('--artists',type=int,default=3,help="artist discographies downloaded by the album case")
+    parser.add_argument('--playlist-songs',type=int,default=1000,help="songs of the playlist case")
+    parser.add_argument('--lyrics',type=int,default=20,help="lyrics of the lyrics and topic cases")
+    parser.add_argument('--queries',type=int,default=10,help="query songs of the similarity case")
+    parser.add_argument('--repeat',type=int,default=3,help="calls of the catalog cases")
+    parser.add_argument('--spacy-model',default='en_core_web_lg',help="english spaCy model of the topic case")
+    parser.add_argument('--workers',type=int,default=1,help="max_workers of the downloader")
+    parser.add_argument('--rate-limit',type=float,default=1000,help="rate_limit of the downloader (requests per second)")
+    parser.add_argument('--latency',type=float,default=0.0,help="seconds added to every response of the stand-in")
+    parser.add_argument('--jitter',type=float,default=0.0,help="max random seconds added to the latency")
+    parser.add_argument('--rate-limit-every',type=int,default=0,help="answer one of every n requests with a 429")
+    parser.add_argument('--retry-after',type=int,default=1,help="Retry-After of the 429 responses in seconds")
+    parser.add_argument('--json',default=None,help="path of a json file where the results are saved")
+    args = parser.parse_args(argv)
+
+    available = list(DOWNLOADER_CASES) + list(PREDICTER_CASES) + list(CATALOG_CASES)
+    cases = available if args.cases is None else args.cases.split(',')
+    unknown = [name for name in cases if name not in available]
+    if unknown:
+        parser.error(f"unknown cases {', '.join(unknown)}, available are {', '.join(available)}")
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    server = StubServer(latency=args.latency,jitter=args.jitter,rate_limit_every=args.rate_limit_every,retry_after=args.retry_after).start()
+    print(f"{'case':<38} {'tracks/sec':>12} {'calls/track':>11} {'429s':>5} {'p50 ms':>9} {'p99 ms':>9} {'rss MB':>9}")
+    results = []
+    try:
+        for name in cases:
+            for size in (sizes if name in CATALOG_CASES else [None]):
+                with ProcessPoolExecutor(max_workers=1,mp_context=multiprocessing.get_context('spawn')) as executor:
+                    result = executor.submit(run_case,name,size,args,server.url).result()
+                results.append(result)
+                print(format_row(result),flush=True)
+    finally:
+        server.stop()
+
+    if args.json is not None:
+        with open(args.json,'w') as f:
+            json.dump({'arguments':vars(args),'results':results},f,indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    main()
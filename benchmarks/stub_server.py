@@ -0,0 +1,418 @@
+"""
+This module implements a local stand-in of the Spotify and Genius APIs used by the benchmarks
+The responses are built from the JSON and HTML fixtures of the fixtures directory for a synthetic catalog:
+every artist has 10 albums and every album has 12 songs, so the ids are enough to answer any request
+Author: Cristóbal Veas
+Linkedln: https://www.linkedin.com/in/cristobal-veas/
+"""
+
+__author__ = "Cristóbal Veas"
+__email__ = "cristobal.veas.ch@gmail.com"
+__status__ = "planning"
+
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, urlencode
+import json
+import os
+import random
+import re
+import threading
+import time
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),'fixtures')
+
+SONGS_PER_ALBUM = 12
+ALBUMS_PER_ARTIST = 10
+
+
+def track_id(n):
+    """
+    Return the spotify id of the song number n of the catalog (ids are base 62 like the real ones)
+    """
+    return f"t{n:09d}"
+
+
+def album_id(n):
+    """
+    Return the spotify id of the album number n of the catalog
+    """
+    return f"a{n:09d}"
+
+
+def artist_id(n):
+    """
+    Return the spotify id of the artist number n of the catalog
+    """
+    return f"r{n:09d}"
+
+
+def playlist_id(n_songs):
+    """
+    Return the spotify id of a playlist with the first n_songs songs of the catalog
+    """
+    return f"p{n_songs:09d}"
+
+
+def is_catalog_id(id,kind):
+    """
+    Return True if id is the id of a song (t), album (a), artist (r) or playlist (p) of the catalog
+    """
+    return re.fullmatch(f"{kind}[0-9]{{9}}",id) is not None
+
+
+def number(id):
+    """
+    Return the number of a song, album, artist or playlist of the catalog given its id
+    """
+    return int(id[1:])
+
+
+class Fixtures():
+    """
+    Class for rendering the fixtures, the {{name}} placeholders of a fixture are replaced by the given values.
+    Attributes
+    ----------
+    path: str - directory of the fixture files (default is the fixtures directory of the benchmarks)
+    """
+
+    def __init__(self,path=FIXTURES):
+        self.templates = {}
+        for name in os.listdir(path):
+            with open(os.path.join(path,name),encoding='utf-8') as f:
+                self.templates[name] = f.read()
+
+    def render(self,name,**values):
+        """
+        Return the text of a fixture with its placeholders replaced
+        """
+        return re.sub(r"\{\{(\w+)\}\}",lambda match: str(values[match.group(1)]),self.templates[name])
+
+    def json(self,name,**values):
+        """
+        Return the object of a json fixture with its placeholders replaced
+        """
+        return json.loads(self.render(name,**values))
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    Class for serving the Spotify and Genius stand-in in a background thread.
+    Attributes
+    ----------
+    port: int - port of the server (default is 0, any free port)
+    latency: float - seconds added to every response (default is 0)
+    jitter: float - max random seconds added to the latency (default is 0)
+    rate_limit_every: int - answer one request of every rate_limit_every requests with a 429 (default is 0, never)
+    retry_after: int - value of the Retry-After header of the 429 responses in seconds (default is 1)
+
+    endpoints:
+    POST /api/token - client credentials and refresh tokens
+    GET /v1/tracks, /v1/audio-features, /v1/albums, /v1/artists - single and multi id endpoints
+    GET /v1/artists/<id>/albums - paginated albums of an artist
+    GET /v1/playlists/<id>, /v1/playlists/<id>/tracks (or /items) - playlists with the first n songs of the catalog
+    GET /genius/api/search/multi, /genius/api/search - genius song searches ("Song <n> Artist <n>")
+    GET /genius/songs/<n> - genius lyrics pages
+    GET /_stats - number of requests served per endpoint
+    """
+    daemon_threads = True
+
+    def __init__(self,port=0,latency=0.0,jitter=0.0,rate_limit_every=0,retry_after=1):
+        super().__init__(('127.0.0.1',port),StubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.fixtures = Fixtures()
+        self.counts = defaultdict(int)
+        self.rate_limited = 0
+        self.served = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        """
+        Start serving in a daemon thread and return the server
+        """
+        self.thread = threading.Thread(target=self.serve_forever,daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop serving and close the socket of the server
+        """
+        self.shutdown()
+        self.server_close()
+
+    def count(self,endpoint):
+        """
+        Count a request of an endpoint and return True if it has to be answered with a 429 (the token endpoint is never rate limited)
+        """
+        with self.lock:
+            self.counts[endpoint] += 1
+            self.served += 1
+            limited = self.rate_limit_every > 0 and self.served % self.rate_limit_every == 0 and endpoint != 'token'
+            if limited:
+                self.rate_limited += 1
+        return limited
+
+    def stats(self):
+        """
+        Return a dictionary with the requests per endpoint, the total of requests and the 429 responses
+        """
+        with self.lock:
+            return {'endpoints':dict(self.counts),'requests':self.served,'rate_limited':self.rate_limited}
+
+    def reset(self):
+        """
+        Reset the request counters
+        """
+        with self.lock:
+            self.counts.clear()
+            self.served = 0
+            self.rate_limited = 0
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Class for answering a request of the stand-in, the routes are matched in order
+    """
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, without this keep-alive clients wait for the delayed ack
+    disable_nagle_algorithm = True
+
+    ROUTES = [
+        ('POST',r"/api/token",'token'),
+        ('GET',r"/v1/tracks/?",'tracks'),
+        ('GET',r"/v1/tracks/(?P<id>\w+)",'track'),
+        ('GET',r"/v1/audio-features/?",'audio_features'),
+        ('GET',r"/v1/audio-features/(?P<id>\w+)",'audio_feature'),
+        ('GET',r"/v1/albums/?",'albums'),
+        ('GET',r"/v1/albums/(?P<id>\w+)/tracks",'album_tracks'),
+        ('GET',r"/v1/albums/(?P<id>\w+)",'album'),
+        ('GET',r"/v1/artists/?",'artists'),
+        ('GET',r"/v1/artists/(?P<id>\w+)/albums",'artist_albums'),
+        ('GET',r"/v1/artists/(?P<id>\w+)",'artist'),
+        ('GET',r"/v1/playlists/(?P<id>\w+)/(?:tracks|items)",'playlist_tracks'),
+        ('GET',r"/v1/playlists/(?P<id>\w+)",'playlist'),
+        ('GET',r"/genius/api/search/multi",'genius_search_multi'),
+        ('GET',r"/genius/api/search",'genius_search'),
+        ('GET',r"/genius/songs/(?P<id>\d+)",'genius_lyrics'),
+        ('GET',r"/_stats",'stats'),
+        ]
+
+    def log_message(self,format,*args):
+        pass
+
+    def do_GET(self):
+        self.__inner__dispatch('GET')
+
+    def do_POST(self):
+        self.__inner__dispatch('POST')
+
+    def __inner__dispatch(self,method):
+        url = urlsplit(self.path)
+        self.query = {key:values[-1] for key,values in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+
+        for route_method,pattern,name in self.ROUTES:
+            match = re.fullmatch(pattern,url.path)
+            if route_method == method and match is not None:
+                break
+        else:
+            return self.__inner__send(404,{'error':{'status':404,'message':'Service not found'}})
+
+        if name == 'stats':
+            return self.__inner__send(200,self.server.stats())
+
+        if self.server.count(name):
+            return self.__inner__send(429,{'error':{'status':429,'message':'API rate limit exceeded'}},
+                                      headers={'Retry-After':str(self.server.retry_after)})
+
+        delay = self.server.latency + random.uniform(0,self.server.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        body = getattr(self,f"route_{name}")(**match.groupdict())
+        if isinstance(body,str):
+            return self.__inner__send(200,body,content_type='text/html; charset=utf-8')
+        return self.__inner__send(200,body)
+
+    def __inner__send(self,status,body,content_type='application/json',headers=None):
+        data = (body if isinstance(body,str) else json.dumps(body)).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type',content_type)
+        self.send_header('Content-Length',str(len(data)))
+        for key,value in (headers or {}).items():
+            self.send_header(key,value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def __inner__ids(self):
+        return [ids for ids in self.query.get('ids','').split(',') if ids]
+
+    def __inner__page(self,path,items,limit,offset,total,**params):
+        """
+        Return a spotify paging object with an absolute next url pointing to the stand-in
+        """
+        next_url = None
+        if offset + limit < total:
+            query = urlencode({**params,'limit':limit,'offset':offset+limit})
+            next_url = f"{self.server.url}{path}?{query}"
+        return {'href':f"{self.server.url}{path}",'items':items,'limit':limit,'offset':offset,'total':total,'next':next_url,'previous':None}
+
+    # spotify objects of the catalog
+
+    def __inner__track(self,id):
+        n = number(id)
+        album_n = n // SONGS_PER_ALBUM
+        artist_n = album_n // ALBUMS_PER_ARTIST
+        rng = random.Random(n)
+        return self.server.fixtures.json('track.json',track_id=id,track_n=n,album_id=album_id(album_n),album_n=album_n,
+                                         artist_id=artist_id(artist_n),artist_n=artist_n,duration_ms=rng.randint(120000,360000),
+                                         popularity=rng.randint(0,100),track_number=n % SONGS_PER_ALBUM + 1)
+
+    def __inner__audio_features(self,id):
+        rng = random.Random(-number(id)-1)
+        return self.server.fixtures.json('audio_features.json',track_id=id,duration_ms=rng.randint(120000,360000),
+                                         acousticness=rng.random(),danceability=rng.random(),energy=rng.random(),
+                                         instrumentalness=rng.random(),liveness=rng.random(),valence=rng.random(),
+                                         loudness=-rng.uniform(0,20),speechiness=rng.random(),tempo=rng.uniform(60,200),key=rng.randint(0,11))
+
+    def __inner__simple_track(self,id):
+        track = self.__inner__track(id)
+        del track['album'], track['external_ids'], track['popularity']
+        return track
+
+    def __inner__album(self,id):
+        n = number(id)
+        artist_n = n // ALBUMS_PER_ARTIST
+        songs = [self.__inner__simple_track(track_id(song)) for song in range(n*SONGS_PER_ALBUM,(n+1)*SONGS_PER_ALBUM)]
+        tracks = self.__inner__page(f"/v1/albums/{id}/tracks",songs,50,0,len(songs))
+        # half of the albums have no genres so the genres of the artist are used
+        genres = ["pop","r&b"] if n % 2 == 0 else []
+        return self.server.fixtures.json('album.json',album_id=id,album_n=n,artist_id=artist_id(artist_n),artist_n=artist_n,
+                                         album_genres=json.dumps(genres),tracks=json.dumps(tracks))
+
+    def __inner__artist(self,id):
+        return self.server.fixtures.json('artist.json',artist_id=id,artist_n=number(id))
+
+    def route_token(self):
+        return {'access_token':'stub-access-token','token_type':'Bearer','expires_in':3600,'scope':''}
+
+    def route_tracks(self):
+        # like spotify, ids without a song are answered with null
+        return {'tracks':[self.__inner__track(ids) if is_catalog_id(ids,'t') else None for ids in self.__inner__ids()]}
+
+    def route_track(self,id):
+        return self.__inner__track(id)
+
+    def route_audio_features(self):
+        return {'audio_features':[self.__inner__audio_features(ids) if is_catalog_id(ids,'t') else None for ids in self.__inner__ids()]}
+
+    def route_audio_feature(self,id):
+        return self.__inner__audio_features(id)
+
+    def route_albums(self):
+        # like spotify, ids without an album are answered with null
+        return {'albums':[self.__inner__album(ids) if is_catalog_id(ids,'a') else None for ids in self.__inner__ids()]}
+
+    def route_album(self,id):
+        return self.__inner__album(id)
+
+    def route_album_tracks(self,id):
+        n = number(id)
+        songs = [self.__inner__simple_track(track_id(song)) for song in range(n*SONGS_PER_ALBUM,(n+1)*SONGS_PER_ALBUM)]
+        limit, offset = int(self.query.get('limit',50)), int(self.query.get('offset',0))
+        return self.__inner__page(f"/v1/albums/{id}/tracks",songs[offset:offset+limit],limit,offset,len(songs))
+
+    def route_artists(self):
+        return {'artists':[self.__inner__artist(ids) for ids in self.__inner__ids()]}
+
+    def route_artist(self,id):
+        return self.__inner__artist(id)
+
+    def route_artist_albums(self,id):
+        n = number(id)
+        limit, offset = int(self.query.get('limit',20)), int(self.query.get('offset',0))
+        albums = []
+        for album in range(n*ALBUMS_PER_ARTIST+offset,min((n+1)*ALBUMS_PER_ARTIST,n*ALBUMS_PER_ARTIST+offset+limit)):
+            album = self.__inner__album(album_id(album))
+            del album['tracks'], album['copyrights'], album['external_ids'], album['genres'], album['label'], album['popularity']
+            albums.append(album)
+        return self.__inner__page(f"/v1/artists/{id}/albums",albums,limit,offset,ALBUMS_PER_ARTIST)
+
+    def route_playlist(self,id):
+        n_songs = number(id)
+        tracks = self.route_playlist_tracks(id)
+        playlist = {'id':id,'name':f"Playlist {n_songs}",'snapshot_id':f"stub-snapshot-{n_songs}",'tracks':tracks,
+                    'description':'','public':True,'type':'playlist','uri':f"spotify:playlist:{id}"}
+        if 'fields' in self.query:
+            fields = [field.split('(')[0] for field in self.query['fields'].split(',')]
+            playlist = {key:value for key,value in playlist.items() if key in fields}
+        return playlist
+
+    def route_playlist_tracks(self,id):
+        n_songs = number(id)
+        limit, offset = int(self.query.get('limit',100)), int(self.query.get('offset',0))
+        items = [{'added_at':'2021-01-01T00:00:00Z','is_local':False,'track':self.__inner__track(track_id(song))}
+                 for song in range(offset,min(n_songs,offset+limit))]
+        params = {key:self.query[key] for key in ('fields','additional_types') if key in self.query}
+        return self.__inner__page(f"/v1/playlists/{id}/tracks",items,limit,offset,n_songs,**params)
+
+    # genius
+
+    def __inner__genius_song(self):
+        match = re.search(r"Song (\d+)",self.query.get('q',''))
+        if match is None:
+            return None
+        song_n = int(match.group(1))
+        artist_n = song_n // SONGS_PER_ALBUM // ALBUMS_PER_ARTIST
+        return self.server.fixtures.json('genius_song.json',song_n=song_n,artist_n=artist_n)
+
+    def route_genius_search_multi(self):
+        song = self.__inner__genius_song()
+        hits = [] if song is None else [{'highlights':[],'index':'song','type':'song','result':song}]
+        return {'meta':{'status':200},'response':{'sections':[{'type':'top_hit','hits':hits},{'type':'song','hits':hits}]}}
+
+    def route_genius_search(self):
+        song = self.__inner__genius_song()
+        hits = [] if song is None else [{'highlights':[],'index':'song','type':'song','result':song}]
+        return {'meta':{'status':200},'response':{'hits':hits}}
+
+    def route_genius_lyrics(self,id):
+        song_n = int(id)
+        artist_n = song_n // SONGS_PER_ALBUM // ALBUMS_PER_ARTIST
+        rng = random.Random(song_n)
+        words = ['love','night','baby','heart','dance','light','time','feel','never','world','dream','fire','away','tonight','blinding']
+        verses = []
+        for verse in ('Verse 1','Chorus','Verse 2','Chorus'):
+            lines = [" ".join(rng.choice(words) for _ in range(rng.randint(4,8))).capitalize() for _ in range(4)]
+            verses.append(f"[{verse}]<br/>" + "<br/>".join(lines))
+        return self.server.fixtures.render('genius_lyrics.html',song_n=song_n,artist_n=artist_n,lyrics="<br/><br/>".join(verses))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve the Spotify and Genius stand-in used by the benchmarks")
+    parser.add_argument('--port',type=int,default=8765)
+    parser.add_argument('--latency',type=float,default=0.0,help="seconds added to every response")
+    parser.add_argument('--jitter',type=float,default=0.0,help="max random seconds added to the latency")
+    parser.add_argument('--rate-limit-every',type=int,default=0,help="answer one of every n requests with a 429")
+    parser.add_argument('--retry-after',type=int,default=1,help="Retry-After of the 429 responses in seconds")
+    args = parser.parse_args()
+
+    server = StubServer(port=args.port,latency=args.latency,jitter=args.jitter,rate_limit_every=args.rate_limit_every,retry_after=args.retry_after)
+    print(f"Serving the Spotify and Genius stand-in on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
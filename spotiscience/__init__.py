@@ -1,3 +1,27 @@
-from spotiscience.downloader import SpotiScienceDownloader
-from spotiscience.prediction import SpotiSciencePredicter
-from spotiscience.credentials import CREDENTIALS
\ No newline at end of file
+import importlib
+
+# the public names are imported from their modules the first time they are used,
+# so importing the package does not load spotipy, spacy or scikit-learn
+_LAZY = {
+    'SpotiScienceDownloader':'spotiscience.downloader',
+    'SpotiSciencePredicter':'spotiscience.prediction',
+    'SpotiScienceCache':'spotiscience.cache',
+    'SimilarityIndex':'spotiscience.index',
+    'songs_to_table':'spotiscience.features',
+    'Metrics':'spotiscience.metrics',
+    'CREDENTIALS':'spotiscience.credentials',
+    }
+
+__all__ = list(_LAZY)
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY[name]),name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
\ No newline at end of file
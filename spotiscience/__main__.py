@@ -0,0 +1,297 @@
+"""
+This module implements the command line interface of spotiscience for bulk downloads
+The ids are read lazily, downloaded by a pool of workers and written in chunks, so the memory used does not depend on the number of ids
+
+usage:
+python -m spotiscience tracks songs.txt -o songs.parquet
+cat playlists.txt | python -m spotiscience playlists -o songs.csv --mood --workers 8
+
+Author: Cristóbal Veas
+Linkedln: https://www.linkedin.com/in/cristobal-veas/
+"""
+
+__author__ = "Cristóbal Veas"
+__email__ = "cristobal.veas.ch@gmail.com"
+__status__ = "planning"
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from functools import partial
+from itertools import islice
+import argparse
+import csv
+import json
+import signal
+import sys
+from spotiscience.features import SONG_KEYS, SONG_DTYPES
+
+
+def read_ids(file):
+    """
+    Return an iterator over the ids or copy links of a file (one per line, empty lines and lines starting with # are skipped)
+    Attributes
+    ----------
+    file: file - the opened file
+    """
+    for line in file:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+def chunked(iterable,size):
+    """
+    Return an iterator over lists of at most size items of an iterable
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator,size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def download_tracks(sd,ids):
+    # same order as the ids, None for the ids spotify can not resolve
+    return sd.get_songs_features(ids)
+
+
+def download_albums(sd,ids):
+    albums = sd.get_albums_song_features(ids)
+    return [song for songs in albums.values() for song in songs]
+
+
+def download_artist(sd,id):
+    albums = sd.get_albums_song_features(id,is_artist=True)
+    return [dict(song,source=id) for songs in albums.values() for song in songs]
+
+
+def download_playlist(sd,id):
+    return [dict(song,source=id) for songs in sd.iter_playlist_song_features(id) for song in songs]
+
+
+# download functions of the kinds whose ids are requested in batches
+BATCHED = {'tracks':download_tracks,'albums':download_albums}
+
+
+def iter_jobs(sd,kind,ids):
+    """
+    Return an iterator over the download jobs of the ids, every job is a tuple with the list of ids and a function returning a list of songs
+    Tracks and albums are downloaded in batches of the tracks and albums endpoints, artists and playlists one by one
+    Attributes
+    ----------
+    sd: SpotiScienceDownloader - the downloader
+    kind: str - the type of the ids (tracks, albums, artists or playlists)
+    ids: iterable - the ids or copy links
+    """
+    if kind in BATCHED:
+        batch_size = sd.tracks_batch_size if kind == 'tracks' else sd.albums_batch_size
+        for batch in chunked(ids,batch_size):
+            yield batch,partial(BATCHED[kind],sd,batch)
+    elif kind == 'artists':
+        for id in ids:
+            yield [id],partial(download_artist,sd,id)
+    else:
+        for id in ids:
+            yield [id],partial(download_playlist,sd,id)
+
+
+def run_jobs(jobs,workers):
+    """
+    Return an iterator over the (ids, songs, error) of the jobs run by a pool of threads (same order as the input)
+    At most two jobs per worker are queued, so the ids are read as the results are consumed
+    Attributes
+    ----------
+    jobs: iterable - the (ids, function) jobs
+    workers: int - number of threads
+    """
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+
+    def result():
+        ids,future = pending.popleft()
+        try:
+            return ids,future.result(),None
+        except Exception as e:
+            return ids,None,e
+
+    try:
+        for ids,job in jobs:
+            pending.append((ids,executor.submit(job)))
+            if len(pending) >= 2*workers:
+                yield result()
+        while pending:
+            yield result()
+    finally:
+        executor.shutdown(wait=False,cancel_futures=True)
+
+
+def retry_failed(sd,kind,results):
+    """
+    Return an iterator over the (ids, songs, error) results where every failed batch is replaced by the results of its ids downloaded one by one,
+    so a bad id only costs its own row
+    Attributes
+    ----------
+    sd: SpotiScienceDownloader - the downloader
+    kind: str - the type of the ids (tracks, albums, artists or playlists)
+    results: iterable - the results of run_jobs
+    """
+    for ids,songs,error in results:
+        if error is None or len(ids) == 1:
+            yield ids,songs,error
+            continue
+        for id in ids:
+            try:
+                yield [id],BATCHED[kind](sd,[id]),None
+            except Exception as e:
+                yield [id],None,e
+
+
+class ParquetOutput():
+    """
+    Class for writing songs to a parquet file, every write is a row group
+    The file footer is written when the output is closed, so it has to be closed even if the download fails
+    Attributes
+    ----------
+    path: str - the path of the parquet file
+    columns: list - the names of the columns
+    """
+    TYPES = {'string':'string','category':'string','Int16':'int16','Int32':'int32','float32':'float32'}
+
+    def __init__(self,path,columns):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = pa.schema([(column,getattr(pa,self.TYPES[SONG_DTYPES.get(column,'string')])()) for column in columns])
+        self.writer = pq.ParquetWriter(path,self.schema)
+
+    def write(self,rows):
+        self.writer.write_table(self.pa.Table.from_pylist(rows,schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class CsvOutput():
+    """
+    Class for writing songs to a csv file, the rows are flushed after every write
+    Attributes
+    ----------
+    path: str - the path of the csv file
+    columns: list - the names of the columns
+    """
+
+    def __init__(self,path,columns):
+        self.file = open(path,'w',newline='',encoding='utf-8')
+        self.writer = csv.DictWriter(self.file,fieldnames=columns,extrasaction='ignore')
+        self.writer.writeheader()
+
+    def write(self,rows):
+        self.writer.writerows(rows)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def add_moods(predicter,songs):
+    """
+    Add the predicted mood to every song, songs without audio features get None
+    Attributes
+    ----------
+    predicter: SpotiSciencePredicter - the predicter
+    songs: [dict,dict,...] - the songs
+    """
+    complete = [song for song in songs if all(song[key] is not None for key in SONG_KEYS[6:])]
+    for song,mood in zip(complete,predicter.predict_song_moods(complete)):
+        song['mood'] = mood
+    for song in songs:
+        song.setdefault('mood',None)
+    return songs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m spotiscience',description="Download the song features of spotify tracks, albums, artists or playlists")
+    parser.add_argument('kind',choices=['tracks','albums','artists','playlists'],help="type of the ids")
+    parser.add_argument('input',nargs='?',default='-',help="file with one id or copy link per line (default is stdin)")
+    parser.add_argument('-o','--output',required=True,help="path of the output file")
+    parser.add_argument('--format',choices=['parquet','csv'],default=None,help="format of the output (default is csv for .csv outputs and parquet otherwise)")
+    parser.add_argument('--chunk-size',type=int,default=10000,help="rows per parquet row group or csv write (default is 10000)")
+    parser.add_argument('--workers',type=int,default=4,help="number of ids downloaded concurrently (default is 4)")
+    parser.add_argument('--rate-limit',type=float,default=10,help="max API requests per second (default is 10)")
+    parser.add_argument('--mood',action='store_true',help="add a column with the predicted mood of every song")
+    parser.add_argument('--credentials',default=None,help="json file with the credentials (default is spotiscience/credentials.py)")
+    parser.add_argument('--cache',default=None,help="path of the SQLite cache of song features (default is no cache)")
+    parser.add_argument('--token-cache',default=None,help="path prefix of the token cache files (default is None, tokens kept in memory)")
+    args = parser.parse_args(argv)
+
+    from spotiscience.downloader import SpotiScienceDownloader
+    from spotiscience.cache import SpotiScienceCache
+
+    if args.credentials is not None:
+        with open(args.credentials) as f:
+            credentials = json.load(f)
+    else:
+        from spotiscience.credentials import CREDENTIALS as credentials
+
+    cache = SpotiScienceCache(args.cache) if args.cache is not None else None
+    # the workers download different ids, the requests of all of them share the rate limit and the in flight limit
+    sd = SpotiScienceDownloader(credentials=credentials,cache_path=args.token_cache,max_workers=1,max_in_flight=args.workers,rate_limit=args.rate_limit,cache=cache)
+    predicter = None
+    if args.mood:
+        from spotiscience.prediction import SpotiSciencePredicter
+        predicter = SpotiSciencePredicter()
+
+    columns = (['source'] if args.kind in ('artists','playlists') else []) + SONG_KEYS + (['mood'] if args.mood else [])
+    output_format = args.format or ('csv' if args.output.endswith('.csv') else 'parquet')
+
+    # a terminated run closes the output like an interrupted one
+    signal.signal(signal.SIGTERM,lambda signum,frame: sys.exit(128+signum))
+
+    input_file = sys.stdin if args.input == '-' else open(args.input,encoding='utf-8')
+    output = (CsvOutput if output_format == 'csv' else ParquetOutput)(args.output,columns)
+    failed = 0
+    rows = 0
+    buffer = []
+    try:
+        # the progress messages of the downloader are written to stderr
+        with redirect_stdout(sys.stderr):
+            for ids,songs,error in retry_failed(sd,args.kind,run_jobs(iter_jobs(sd,args.kind,read_ids(input_file)),args.workers)):
+                if error is not None:
+                    failed += len(ids)
+                    print(f"{', '.join(ids)} could not be downloaded: {error}",file=sys.stderr)
+                    continue
+                if None in songs:
+                    # only the tracks jobs return None, in the position of the ids spotify can not resolve
+                    unresolved = [id for id,song in zip(ids,songs) if song is None]
+                    failed += len(unresolved)
+                    print(f"{', '.join(unresolved)} not found",file=sys.stderr)
+                    songs = [song for song in songs if song is not None]
+                if predicter is not None:
+                    songs = add_moods(predicter,songs)
+                buffer.extend(songs)
+                while len(buffer) >= args.chunk_size:
+                    output.write(buffer[:args.chunk_size])
+                    rows += args.chunk_size
+                    del buffer[:args.chunk_size]
+    finally:
+        # the songs already downloaded are written even if the run is interrupted, so the output is always complete and valid
+        try:
+            if buffer:
+                output.write(buffer)
+                rows += len(buffer)
+        finally:
+            output.close()
+        if input_file is not sys.stdin:
+            input_file.close()
+        if cache is not None:
+            cache.close()
+
+    print(f"{rows} songs written to {args.output}",file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""
+This module implements a local on-disk cache for the data downloaded from Spotify and Genius
+Author: Cristóbal Veas
+Linkedln: https://www.linkedin.com/in/cristobal-veas/
+"""
+
+__author__ = "Cristóbal Veas"
+__email__ = "cristobal.veas.ch@gmail.com"
+__status__ = "planning"
+
+from collections import OrderedDict, defaultdict
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+
+class SpotiScienceCache():
+    """
+    Class for caching downloaded data in a local SQLite database.
+    Entries are keyed by the spotify id and stored by field group, every group has its own time to live.
+    Attributes
+    ----------
+    path: str - path of the SQLite database file (default is 'spotiscience.db', use ':memory:' for a cache living only in the process)
+    ttl: dict - seconds that the entries of each field group are valid, None means they never expire
+          {
+              'metadata': int - song name, artist, album, release date, popularity and length (default is 7 days),
+              'audio_features': int - spotify audio features of the song (default is None, they never change),
+              'genres': int - spotify genres of the song (default is 30 days),
+              'lyrics': int - genius lyrics of the song, keyed by the normalized song and artist names (default is None),
+              'lyrics_misses': int - songs without lyrics in genius (default is 7 days),
+              'tokens': int - tokenized lyrics of the predicter, keyed by a hash of the lyric and the tokenizer settings (default is None)
+          }
+    metrics: Metrics - registry where the hits and misses of every lookup are recorded (default is None, a downloader with metrics sets its own)
+    """
+    DEFAULT_TTL = {
+        'metadata': 7*24*3600,
+        'audio_features': None,
+        'genres': 30*24*3600,
+        'lyrics': None,
+        'lyrics_misses': 7*24*3600,
+        'tokens': None,
+        }
+
+    def __init__(self,path='spotiscience.db',ttl=None,metrics=None):
+        self.path = path
+        self.ttl = dict(self.DEFAULT_TTL)
+        if ttl is not None:
+            self.ttl.update(ttl)
+
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self.metrics = metrics
+
+        self.__lock = threading.Lock()
+        self.__conn = sqlite3.connect(path,check_same_thread=False)
+        with self.__conn:
+            self.__conn.execute("PRAGMA journal_mode=WAL")
+            self.__conn.execute("""CREATE TABLE IF NOT EXISTS entries (
+                                    field_group TEXT NOT NULL,
+                                    id TEXT NOT NULL,
+                                    value BLOB NOT NULL,
+                                    updated REAL NOT NULL,
+                                    PRIMARY KEY (field_group,id))""")
+
+    def __inner__encode(self,value):
+        """
+        Return the compressed json representation of a value
+        """
+        return zlib.compress(json.dumps(value).encode('utf-8'))
+
+    def __inner__decode(self,value):
+        """
+        Return the value stored as compressed json
+        """
+        return json.loads(zlib.decompress(value).decode('utf-8'))
+
+    def get(self,group,id,default=None):
+        """
+        Return the cached value of an id in a field group (default if the id is not cached or the entry expired)
+        Attributes
+        ----------
+        group: str - the name of the field group
+        id: str - the spotify id
+        default: object - the value returned on a cache miss (default is None)
+        """
+        return self.get_many(group,[id]).get(id,default)
+
+    def get_many(self,group,ids):
+        """
+        Return a dictionary with the cached values of a list of ids in a field group, ids not cached or expired are left out
+        Attributes
+        ----------
+        group: str - the name of the field group
+        ids: [str,str,...] - the spotify ids
+        """
+        ids = list(dict.fromkeys(ids))
+        ttl = self.ttl.get(group)
+        oldest = time.time() - ttl if ttl is not None else float('-inf')
+        RESULTS = {}
+        with self.__lock:
+            # sqlite limits the number of variables of a single query
+            for i in range(0,len(ids),500):
+                batch = ids[i:i+500]
+                rows = self.__conn.execute(f"SELECT id,value,updated FROM entries WHERE field_group=? AND id IN ({','.join('?'*len(batch))})",[group]+batch)
+                for id,value,updated in rows:
+                    if updated >= oldest:
+                        RESULTS[id] = self.__inner__decode(value)
+            self.hits[group] += len(RESULTS)
+            self.misses[group] += len(ids) - len(RESULTS)
+        if self.metrics is not None:
+            self.metrics.inc('cache_hits_total',len(RESULTS),group=group)
+            self.metrics.inc('cache_misses_total',len(ids)-len(RESULTS),group=group)
+        return RESULTS
+
+    def put(self,group,id,value):
+        """
+        Store the value of an id in a field group
+        Attributes
+        ----------
+        group: str - the name of the field group
+        id: str - the spotify id
+        value: object - any json serializable value
+        """
+        self.put_many(group,{id:value})
+
+    def put_many(self,group,values):
+        """
+        Store the values of many ids in a field group
+        Attributes
+        ----------
+        group: str - the name of the field group
+        values: dict - dictionary where the keys are the spotify ids and the values any json serializable value
+        """
+        now = time.time()
+        rows = [(group,id,self.__inner__encode(value),now) for id,value in values.items()]
+        with self.__lock, self.__conn:
+            self.__conn.executemany("INSERT OR REPLACE INTO entries (field_group,id,value,updated) VALUES (?,?,?,?)",rows)
+
+    def clear(self,group=None):
+        """
+        Remove all the entries of a field group (default is None, remove every entry)
+        """
+        with self.__lock, self.__conn:
+            if group is None:
+                self.__conn.execute("DELETE FROM entries")
+            else:
+                self.__conn.execute("DELETE FROM entries WHERE field_group=?",(group,))
+
+    def stats(self):
+        """
+        Return a dictionary with the hit and miss counters and the hit rate of each field group
+        """
+        STATS = {}
+        for group in set(self.hits) | set(self.misses):
+            total = self.hits[group] + self.misses[group]
+            STATS[group] = {'hits':self.hits[group],'misses':self.misses[group],'hit_rate':self.hits[group]/total if total else 0.0}
+        return STATS
+
+    def close(self):
+        """
+        Close the connection to the database
+        """
+        self.__conn.close()
+
+
+class LRUCache():
+    """
+    Class for keeping a bounded number of values in memory, the least recently used values are dropped first.
+    Attributes
+    ----------
+    maxsize: int - max number of values kept (default is 1024)
+    """
+
+    def __init__(self,maxsize=1024):
+        self.maxsize = maxsize
+        self.__values = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__values)
+
+    def get_many(self,keys):
+        """
+        Return a dictionary with the values of the keys kept in the cache, missing keys are left out
+        Attributes
+        ----------
+        keys: list - the keys to look up
+        """
+        RESULTS = {}
+        with self.__lock:
+            for key in keys:
+                if key in self.__values:
+                    self.__values.move_to_end(key)
+                    RESULTS[key] = self.__values[key]
+        return RESULTS
+
+    def put_many(self,values):
+        """
+        Store many values dropping the least recently used ones when the cache is full
+        Attributes
+        ----------
+        values: dict - dictionary with the keys and values to store
+        """
+        with self.__lock:
+            for key,value in values.items():
+                self.__values[key] = value
+                self.__values.move_to_end(key)
+            while len(self.__values) > self.maxsize:
+                self.__values.popitem(last=False)
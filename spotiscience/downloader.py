@@ -9,12 +9,25 @@ __email__ = "cristobal.veas.ch@gmail.com"
 __status__ = "planning"
 
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import json
+import os
 import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials, SpotifyOAuth
-import lyricsgenius
+from spotipy.cache_handler import CacheFileHandler, MemoryCacheHandler
 import re
+import unicodedata
 import numpy as np 
+from spotiscience.ratelimit import TokenBucket
+from spotiscience.features import songs_to_table
+from spotiscience.cache import LRUCache
+from spotiscience.metrics import timer
 
 class SpotiScienceDownloader():
     """
@@ -33,10 +46,21 @@ class SpotiScienceDownloader():
     scope_playlist: str - authorization scope  defined by Spotify to use certain API methods for playlist downloading
     scope_user: str - authorization scope  defined by Spotify to use certain API methos for music downloading
     scope_user_modify: str - authorization scope  defined by Spotify to use certain API methos for app interaction
+    pool_size: int - max number of keep-alive connections kept open to the spotify API (default is 10)
+    cache_path: str - path prefix for the token cache files, one file per scope (default is None, tokens of the client credentials flow are kept in memory)
+    token_refresh_margin: int - seconds before the token expiration in which the token is refreshed (default is 60)
+    max_workers: int - number of threads used to download concurrently (default is 1, sequential download)
+    max_in_flight: int - max number of API requests running at the same time (default is max_workers)
+    rate_limit: float - max number of API requests per second shared by all the workers (default is 10)
+    max_retries: int - max number of retries of a request after a 429 or 5xx response (default is 5)
+    backoff_factor: float - base seconds of the exponential backoff between retries (default is 0.5)
+    cache: SpotiScienceCache - local cache of song metadata, audio features and genres (default is None, no cache)
+    genres_memo_size: int - max number of album and artist genres kept in memory between calls (default is 4096, None disables it)
+    metrics: Metrics - registry where the API calls, retries, throttling sleeps, token requests and cache lookups are recorded (default is None, nothing is recorded)
 
     more information of Spotify API scopes: https://developer.spotify.com/documentation/general/guides/scopes/
     """
-    def __init__(self,credentials):
+    def __init__(self,credentials,pool_size=10,cache_path=None,token_refresh_margin=60,max_workers=1,max_in_flight=None,rate_limit=10,max_retries=5,backoff_factor=0.5,cache=None,genres_memo_size=4096,metrics=None):
 
         self.client_id = credentials['client_id']
         self.client_secret = credentials['client_secret']
@@ -48,6 +72,34 @@ class SpotiScienceDownloader():
         self.scope_user = 'user-library-read'
         self.scope_user_modify = 'user-library-modify' 
 
+        # max number of ids per request allowed by the spotify multi id endpoints
+        self.tracks_batch_size = 50
+        self.features_batch_size = 100
+        self.albums_batch_size = 20
+
+        self.pool_size = pool_size
+        self.cache_path = cache_path
+        self.token_refresh_margin = token_refresh_margin
+
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.limiter = TokenBucket(rate_limit)
+        self.__in_flight = threading.BoundedSemaphore(max_in_flight or max_workers)
+
+        self.cache = cache
+        self.genres_memo = LRUCache(genres_memo_size) if genres_memo_size else None
+
+        self.metrics = metrics
+        if metrics is not None and cache is not None and cache.metrics is None:
+            cache.metrics = metrics
+
+        # long-lived spotify clients (one per scope) sharing a single http connection pool
+        self.__session = None
+        self.__clients = {}
+        self.__lock = threading.Lock()
+        self.__genius = None
+
     def __inner__clean_spotify_id(self,id):
         """
         Search and return a string object id from the spotify copy object link 
@@ -59,56 +111,300 @@ class SpotiScienceDownloader():
         id = re.search(pattern,id).group()
         return id
 
+    def __inner__http_session(self):
+        """
+        Return the keep-alive http session shared by all the spotify clients of the downloader
+        """
+        if self.__session is None:
+            # only connection errors are retried here, 429 and 5xx responses are retried (and counted) by __inner__request
+            retry = Retry(total=self.max_retries,read=False,status_forcelist=(),respect_retry_after_header=False,backoff_factor=self.backoff_factor)
+            adapter = HTTPAdapter(pool_connections=self.pool_size,pool_maxsize=self.pool_size,max_retries=retry)
+            session = requests.Session()
+            session.mount('https://',adapter)
+            session.mount('http://',adapter)
+            self.__session = session
+        return self.__session
+
+    def __inner__refresh_token(self,manager):
+        """
+        Refresh the access token of the authorization manager when it is about to expire (client credentials tokens are also requested when there is none)
+        Attributes
+        ----------
+        manager: object - the spotify authorization manager (client credentials or oauth)
+        """
+        token_info = manager.cache_handler.get_cached_token()
+        if token_info is not None and token_info['expires_at'] - time.time() > self.token_refresh_margin:
+            return
+        if isinstance(manager,SpotifyOAuth):
+            # without a cached token the user authorization is asked by spotipy on the first request
+            if token_info is None:
+                return
+            with timer(self.metrics,'auth_seconds',flow='oauth'):
+                manager.refresh_access_token(token_info['refresh_token'])
+        else:
+            # the first token is also requested here, so the handshake is not mixed with the first API request
+            with timer(self.metrics,'auth_seconds',flow='client_credentials'):
+                manager.get_access_token(as_dict=False,check_cache=False)
+
+    def __inner__request(self,sp,method,*args,**kwargs):
+        """
+        Call a spotify API method respecting the shared rate limit and the max number of requests in flight
+        429 responses are retried after the Retry-After header and 5xx responses with exponential backoff
+        Attributes
+        ----------
+        sp: object - the spotify API client
+        method: str - the name of the client method to call
+        *args, **kwargs - the arguments of the client method
+        """
+        return self.__inner__call(method,getattr(sp,method),*args,**kwargs)
+
+    def __inner__next_page(self,sp,endpoint,page):
+        """
+        Return the page following a spotify paging object, the request is recorded under the endpoint of the first page
+        Attributes
+        ----------
+        sp: object - the spotify API client
+        endpoint: str - the name of the client method that returned the first page
+        page: dict - the spotify paging object
+        """
+        return self.__inner__call(endpoint,sp.next,page)
+
+    def __inner__call(self,endpoint,function,*args,**kwargs):
+        """
+        Return the result of a spotify client function called through __inner__throttled, the spotify errors of the last attempt are raised
+        Attributes
+        ----------
+        endpoint: str - the name under which the requests are recorded
+        function: function - the client function to call
+        *args, **kwargs - the arguments of the client function
+        """
+        def call():
+            try:
+                return function(*args,**kwargs),200,None
+            except spotipy.SpotifyException as e:
+                return e,e.http_status or 0,e.headers or {}
+
+        result = self.__inner__throttled(endpoint,call)
+        if isinstance(result,spotipy.SpotifyException):
+            raise result
+        return result
+
+    def __inner__throttled(self,endpoint,call):
+        """
+        Return the result of an API call made respecting the shared rate limit and the max number of requests in flight
+        429 responses are retried after the Retry-After header and 5xx responses with exponential backoff, the result of the last attempt is returned
+        Attributes
+        ----------
+        endpoint: str - the name of the endpoint recorded in the metrics
+        call: callable - function making the request and returning a tuple with the result, the http status and the response headers
+        """
+        metrics = self.metrics
+        attempt = 0
+        while True:
+            waited = self.limiter.acquire()
+            if metrics is not None and waited > 0:
+                metrics.inc('throttle_seconds_total',waited,reason='rate_limit')
+            with self.__in_flight:
+                start = time.perf_counter()
+                try:
+                    result,status,headers = call()
+                except Exception:
+                    if metrics is not None:
+                        self.__inner__record_request(endpoint,0,start)
+                    raise
+                if metrics is not None:
+                    self.__inner__record_request(endpoint,status,start)
+            if attempt >= self.max_retries or (status != 429 and status < 500):
+                return result
+            delay = self.backoff_factor * 2 ** attempt
+            if metrics is not None:
+                metrics.inc('api_retries_total',endpoint=endpoint,status=status)
+            if status == 429:
+                if metrics is not None:
+                    metrics.inc('api_rate_limited_total',endpoint=endpoint)
+                retry_after = headers.get('Retry-After')
+                self.limiter.pause(float(retry_after) if retry_after else delay)
+            else:
+                if metrics is not None:
+                    metrics.inc('throttle_seconds_total',delay,reason='backoff')
+                time.sleep(delay)
+            attempt += 1
+
+    def __inner__record_request(self,endpoint,status,start):
+        """
+        Record an API request in the metrics of the downloader
+        Attributes
+        ----------
+        endpoint: str - the name of the client method
+        status: int - the http status of the response
+        start: float - the perf_counter value when the request started
+        """
+        self.metrics.inc('api_requests_total',endpoint=endpoint,status=status)
+        self.metrics.observe('api_request_seconds',time.perf_counter()-start,endpoint=endpoint)
+
+    def __inner__map(self,function,items):
+        """
+        Return a list with the results of applying the function to every item (same order as the input)
+        The items are processed by a thread pool when the downloader uses more than one worker
+        Attributes
+        ----------
+        function: callable - the function to apply
+        items: list - the items to process
+        """
+        items = list(items)
+        if self.max_workers <= 1 or len(items) <= 1:
+            return [function(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers,len(items))) as executor:
+            return list(executor.map(function,items))
+
     def __inner__auth_spotify_music(self):
         """
         Return the object api authorization for downloading  spotify global music data
+        The client is created once and reused by every method of the downloader
         """
-        manager = SpotifyClientCredentials(self.client_id,self.client_secret)
-        sp = spotipy.Spotify(client_credentials_manager=manager)
+        with self.__lock:
+            sp = self.__clients.get('music')
+            if sp is None:
+                if self.cache_path is None:
+                    cache_handler = MemoryCacheHandler()
+                else:
+                    cache_handler = CacheFileHandler(cache_path=f"{self.cache_path}-music")
+                manager = SpotifyClientCredentials(self.client_id,self.client_secret,cache_handler=cache_handler,requests_session=self.__inner__http_session())
+                sp = spotipy.Spotify(client_credentials_manager=manager,requests_session=self.__inner__http_session())
+                self.__clients['music'] = sp
+            self.__inner__refresh_token(sp.auth_manager)
         return sp
 
     def __inner__auth_spotify_user_music(self,scope):
         """
         Return the  object api authorization for downloading  spotify music related by the user account 
+        The client is created once per scope and reused by every method of the downloader
         Attributes
         ----------
         scope: str - the spotify API authorization scope
         """
-        auth_manager = SpotifyOAuth(scope=scope,client_id=self.client_id,client_secret=self.client_secret,username=self.user_id, redirect_uri=self.redirect_url)
-        sp = spotipy.Spotify(auth_manager=auth_manager)
+        with self.__lock:
+            sp = self.__clients.get(scope)
+            if sp is None:
+                cache_handler = None
+                if self.cache_path is not None:
+                    cache_handler = CacheFileHandler(cache_path=f"{self.cache_path}-{scope}")
+                auth_manager = SpotifyOAuth(scope=scope,client_id=self.client_id,client_secret=self.client_secret,username=self.user_id, redirect_uri=self.redirect_url,
+                                            cache_handler=cache_handler,requests_session=self.__inner__http_session())
+                sp = spotipy.Spotify(auth_manager=auth_manager,requests_session=self.__inner__http_session())
+                self.__clients[scope] = sp
+            self.__inner__refresh_token(sp.auth_manager)
         return sp 
 
+    def __inner__get_all_pages(self,sp,endpoint,page):
+        """
+        Return a list with the items of a paging object and all its following pages
+        Attributes
+        ----------
+        sp: object - the spotify API client
+        endpoint: str - the name of the client method that returned the first page, the following pages are recorded under it
+        page: dict - the first spotify paging object
+        """
+        items = list(page['items'])
+        while page['next'] is not None:
+            page = self.__inner__next_page(sp,endpoint,page)
+            items.extend(page['items'])
+        return items
+
     def __inner__get_albums_id(self,artist_id):
         """
         Return a list with Spotify album ids given a Spotify artist id
+        All the pages of the artist albums are read and the re-releases of an album (same name and type) are dropped
         Attributes
         ----------
         artist_id: str - the spotify id of the artist
         """
-        album_ids = []
         sp = self.__inner__auth_spotify_music()
-        results = sp.artist_albums(artist_id)
-        for album in results['items']:
-            album_ids.append(album['id'])
-        return album_ids
+        results = self.__inner__request(sp,'artist_albums',artist_id,limit=50)
+        album_ids = {}
+        for album in self.__inner__get_all_pages(sp,'artist_albums',results):
+            album_ids.setdefault((album['name'].lower(),album['album_type']),album['id'])
+        return list(album_ids.values())
 
-    def __inner__get_album_songs_id(self,album_id):
+    def __inner__get_albums_songs_id(self,album_ids):
         """
-        Return  a list with Spotify song ids given a Spotify album id
+        Return a list of tuples (album name, list of Spotify song ids) given a list of Spotify album ids (same order as the input)
+        Albums are requested in batches of 20 and the batches are requested concurrently, unknown albums (null in the response) are skipped
         Attributes
         ----------
-        album_id: str - the spotify id of the album
+        album_ids: [str,str,...] - the spotify ids of the albums
         """
-        song_ids = []
         sp = self.__inner__auth_spotify_music()
-        results = sp.album_tracks(album_id,offset=0)
-        for songs in results['items']:
-            song_ids.append(songs['id'])
-        return song_ids
+
+        def get_batch(batch):
+            albums = self.__inner__request(sp,'albums',batch)['albums']
+            return [(album['name'],[song['id'] for song in self.__inner__get_all_pages(sp,'albums',album['tracks'])]) for album in albums if album is not None]
+
+        batches = [album_ids[i:i+self.albums_batch_size] for i in range(0,len(album_ids),self.albums_batch_size)]
+        return [album for batch in self.__inner__map(get_batch,batches) for album in batch]
+
+    def __inner__build_metadata(self,meta):
+        """
+        Return a dictionary with the song metadata given the spotify track object
+        Attributes
+        ----------
+        meta: dict - the spotify track object of the song
+        """
+        METADATA = {}
+        METADATA['id']= meta['id']
+        METADATA['name']= meta['name']
+        METADATA['artist']= meta['album']['artists'][0]['name']
+        METADATA['album']= meta['album']['name']
+        METADATA['release_date']= meta['album']['release_date']
+        METADATA['popularity']= meta['popularity']
+        METADATA['length']= meta['duration_ms']
+        return METADATA
+
+    def __inner__build_audio_features(self,feature):
+        """
+        Return a dictionary with the song audio features given the spotify audio features object
+        Attributes
+        ----------
+        feature: dict - the spotify audio features object of the song (None if spotify has no analysis for it)
+        """
+        AUDIO = {}
+        feature = feature or {}
+        AUDIO['acousticness']= feature.get('acousticness')
+        AUDIO['danceability']= feature.get('danceability')
+        AUDIO['energy']= feature.get('energy')
+        AUDIO['instrumentalness']= feature.get('instrumentalness')
+        AUDIO['liveness']= feature.get('liveness')
+        AUDIO['valence']= feature.get('valence')
+        AUDIO['loudness']= feature.get('loudness')
+        AUDIO['speechiness']= feature.get('speechiness')
+        AUDIO['tempo']= feature.get('tempo')
+        AUDIO['key']= feature.get('key')
+        AUDIO['time_signature']= feature.get('time_signature')
+        return AUDIO
+
+    def __inner__fetch_many(self,sp,method,ids,batch_size,field=None):
+        """
+        Return a dictionary where the keys are the ids and the values the spotify objects, requested in batches with a multi id endpoint
+        Attributes
+        ----------
+        sp: object - the spotify API client
+        method: str - the name of the multi id client method (tracks, audio_features, albums, artists)
+        ids: [str,str,...] - the spotify ids
+        batch_size: int - max number of ids per request
+        field: str - the key of the response holding the list of objects (default is None, the response is the list)
+        """
+        batches = [ids[i:i+batch_size] for i in range(0,len(ids),batch_size)]
+        results = self.__inner__map(lambda batch: self.__inner__request(sp,method,batch),batches)
+        OBJECTS = {}
+        for batch,result in zip(batches,results):
+            if field is not None:
+                result = result[field]
+            OBJECTS.update(zip(batch,result))
+        return OBJECTS
 
     def get_song_features(self,song_id):
         """
-        Return a dictionary with the  song features given a spotify song id
+        Return a dictionary with the  song features given a spotify song id (None if spotify has no song with that id)
         Attributes
         ----------
         song_id: str - the spotify id  or the spotify copy link of the song
@@ -117,56 +413,46 @@ class SpotiScienceDownloader():
         copy song link: https://open.spotify.com/track/4MRJvEFvgob7I20cj5WEbE?si=10700e68342840f6
         song id : 4MRJvEFvgob7I20cj5WEbE
         """
+        return self.get_songs_features([song_id])[0]
+
+    def get_songs_features(self,song_ids):
+        """
+        Return a list with the song features dictionaries given a list of spotify song ids (same order as the input)
+        Songs are requested in batches using the spotify multi id endpoints (50 tracks and 100 audio features per call)
+        When the downloader has a cache only the songs missing or expired in the cache are requested
+        Ids that spotify can not resolve (removed or unknown songs) get None and are not cached
+        Attributes
+        ----------
+        song_ids: [str,str,...] - the spotify ids or the spotify copy links of the songs
+        """
+        song_ids = [self.__inner__clean_spotify_id(ids) if "https" in ids else ids for ids in song_ids]
 
-        if "https" in song_id:
-            song_id = self.__inner__clean_spotify_id(song_id)
+        unique_ids = list(dict.fromkeys(song_ids))
 
-        FEATURES = {}
+        if self.cache is not None:
+            METADATA = self.cache.get_many('metadata',unique_ids)
+            AUDIO = self.cache.get_many('audio_features',unique_ids)
+        else:
+            METADATA, AUDIO = {}, {}
 
         sp = self.__inner__auth_spotify_music()
-        meta = sp.track(song_id)
-        feature = sp.audio_features(song_id)
-        # metadata
-        name = meta['name']
-        album = meta['album']['name']
-        artist = meta['album']['artists'][0]['name']
-        release_date = meta['album']['release_date']
-        length = meta['duration_ms']
-        popularity = meta['popularity']
-        ids =  meta['id']
-        # features
-        acousticness = feature[0]['acousticness']
-        danceability = feature[0]['danceability']
-        energy = feature[0]['energy']
-        instrumentalness = feature[0]['instrumentalness']
-        liveness = feature[0]['liveness']
-        valence = feature[0]['valence']
-        loudness = feature[0]['loudness']
-        speechiness = feature[0]['speechiness']
-        tempo = feature[0]['tempo']
-        key = feature[0]['key']
-        time_signature = feature[0]['time_signature']
-
-        FEATURES['id']= ids
-        FEATURES['name']= name
-        FEATURES['artist']= artist
-        FEATURES['album']= album
-        FEATURES['release_date']= release_date
-        FEATURES['popularity']= popularity
-        FEATURES['length']= length
-        FEATURES['acousticness']= acousticness
-        FEATURES['danceability']= danceability
-        FEATURES['energy']= energy
-        FEATURES['instrumentalness']= instrumentalness
-        FEATURES['liveness']= liveness
-        FEATURES['valence']= valence
-        FEATURES['loudness']= loudness
-        FEATURES['speechiness']= speechiness
-        FEATURES['tempo']= tempo
-        FEATURES['key']= key
-        FEATURES['time_signature']= time_signature
-
-        return FEATURES 
+
+        missing = [ids for ids in unique_ids if ids not in METADATA]
+        metas = self.__inner__fetch_many(sp,'tracks',missing,self.tracks_batch_size,field='tracks')
+        # spotify answers null for the ids it can not resolve
+        fetched = {ids:self.__inner__build_metadata(meta) for ids,meta in metas.items() if meta is not None}
+        METADATA.update(fetched)
+        if self.cache is not None and fetched:
+            self.cache.put_many('metadata',fetched)
+
+        missing = [ids for ids in unique_ids if ids in METADATA and ids not in AUDIO]
+        features = self.__inner__fetch_many(sp,'audio_features',missing,self.features_batch_size)
+        fetched = {ids:self.__inner__build_audio_features(feature) for ids,feature in features.items()}
+        AUDIO.update(fetched)
+        if self.cache is not None and fetched:
+            self.cache.put_many('audio_features',fetched)
+
+        return [{**METADATA[ids],**AUDIO[ids]} if ids in METADATA else None for ids in song_ids]
 
     def get_playlist_information(self,playlist_id):
         """
@@ -180,10 +466,10 @@ class SpotiScienceDownloader():
        
         sp = self.__inner__auth_spotify_user_music(self.scope_playlist)
 
-        playlist_info = sp.playlist_tracks(playlist_id)
+        playlist_info = self.__inner__request(sp,'playlist_tracks',playlist_id)
         return playlist_info
         
-    def get_albums_song_features(self,id,is_artist=False):
+    def get_albums_song_features(self,id,is_artist=False,as_table=False):
         """
         Return a dictionary of lists were the dict keys are the name of the album and the lists contains all the songs and its features
         Attributes
@@ -191,6 +477,7 @@ class SpotiScienceDownloader():
         id: str [str,str,...] - the copy link or id of the albums (it could be a single string or list of strings)
         is_artist: boolean - If False, the id attributes should be  album ids or copy link (available as singe string and list of strings)
                              If True, the id attribute should be the artist id (available as single string)
+        as_table: boolean - If True, return a pandas DataFrame with one row per song and compact column types instead of the dictionary of lists
         """
         print("Downloading Albums...")
 
@@ -211,93 +498,347 @@ class SpotiScienceDownloader():
             album_ids = id
             album_ids = [self.__inner__clean_spotify_id(ids) if "https" in ids else ids for ids in album_ids]
 
-        for i,album in enumerate(album_ids):
+        album_ids = list(dict.fromkeys(album_ids))
+        albums = self.__inner__get_albums_songs_id(album_ids)
 
-            song_ids = self.__inner__get_album_songs_id(album)
-            time.sleep(.6)
+        # a song is only downloaded once even if it appears in several albums
+        seen = set()
+        for name,song_ids in albums:
+            song_ids[:] = [song for song in dict.fromkeys(song_ids) if song not in seen]
+            seen.update(song_ids)
 
-            for song in song_ids:
+        songs = iter(self.get_songs_features([song for _,song_ids in albums for song in song_ids]))
+        for name,song_ids in albums:
 
-                song_features = self.get_song_features(song)
-                ALBUMS[song_features['album']].append(song_features)
+            for song_features in islice(songs,len(song_ids)):
+                if song_features is not None:
+                    ALBUMS[song_features['album']].append(song_features)
 
-            print(f"Album {song_features['album']} downloaded!")
+            print(f"Album {name} downloaded!")
 
+        if as_table:
+            return songs_to_table(ALBUMS)
         return ALBUMS 
 
-    def get_playlist_song_features(self,playlist_id,n_songs=100):
+    def get_playlist_song_features(self,playlist_id,n_songs=100,as_table=False):
         """
         Return a dictionary of lists were the dict keys are the name of the playlist and the lists contains all the songs and its features
         Attributes
         ----------
         playlist_id: str - the copy link or id of the playlist 
         n_songs: boolean - number of playlist songs (default is 100)
+        as_table: boolean - If True, return a pandas DataFrame with one row per song, compact column types and a 'playlist' column instead of the dictionary of lists
         """
         print("Downloading Playlist...")
         PLAYLISTS = defaultdict(list)
-        songs_ids = []
 
         if "https" in playlist_id:
             playlist_id = self.__inner__clean_spotify_id(playlist_id)
 
         sp = self.__inner__auth_spotify_user_music(self.scope_playlist)
 
-        playlist_info = sp.playlist(playlist_id)
-
-        if n_songs < 100:
-            playlist = sp.playlist_tracks(playlist_id,limit=n_songs)
-            for songs in playlist['items']:
-                songs_ids.append(songs['track']['id'])
-
-        if n_songs >= 100:
-            for i in range(0,n_songs,100):
-                playlist = sp.playlist_tracks(playlist_id,limit=100,offset=i)
-                for songs in playlist['items']:
-                    songs_ids.append(songs['track']['id'])
+        playlist_info = self.__inner__request(sp,'playlist',playlist_id,fields='name')
 
-        for song in songs_ids:
-            time.sleep(.6)
-            song_features = self.get_song_features(song)
-            PLAYLISTS[playlist_info['name']].append(song_features)
+        for songs in self.iter_playlist_song_features(playlist_id,n_songs=n_songs):
+            PLAYLISTS[playlist_info['name']].extend(songs)
 
         print(f"Playlist {playlist_info['name']} downloaded!")
-            
+
+        if as_table:
+            return songs_to_table(PLAYLISTS,group='playlist')
         return PLAYLISTS
 
+    def iter_playlist_song_features(self,playlist_id,n_songs=None,checkpoint=None):
+        """
+        Return an iterator over the songs of a playlist yielding a list with the songs features of every page of the playlist (100 songs)
+        Pages are followed with the 'next' cursor of the API and the next page is requested while the current one is processed
+        Attributes
+        ----------
+        playlist_id: str - the copy link or id of the playlist
+        n_songs: int - max number of playlist songs (default is None, all the songs)
+        checkpoint: str - path of a json file where the position of the last page processed by the consumer is saved (default is None)
+                          If the file exists the download resumes after that page, it is removed when the playlist is completed
+                          A page is saved as processed when the consumer asks for the next one, so a consumer that stops after
+                          receiving a page gets that page again on resume (pages are delivered at least once)
+                          A checkpoint file of another playlist raises a ValueError, use one checkpoint file per playlist
+        """
+        if "https" in playlist_id:
+            playlist_id = self.__inner__clean_spotify_id(playlist_id)
+
+        offset = 0
+        if checkpoint is not None and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                state = json.load(f)
+            if state['playlist_id'] != playlist_id:
+                raise ValueError(f"the checkpoint {checkpoint} belongs to the playlist {state['playlist_id']}, not to {playlist_id}")
+            offset = state['offset']
+
+        if n_songs is not None and offset >= n_songs:
+            return
+
+        sp = self.__inner__auth_spotify_user_music(self.scope_playlist)
+
+        limit = 100 if n_songs is None else min(100,n_songs-offset)
+        page = self.__inner__request(sp,'playlist_items',playlist_id,fields='items(track(id)),next',limit=limit,offset=offset,additional_types=('track',))
+
+        with ThreadPoolExecutor(max_workers=1) as prefetch:
+            while page is not None:
+                items = page['items']
+                if n_songs is not None:
+                    items = items[:n_songs-offset]
+                done = page['next'] is None or (n_songs is not None and offset+len(items) >= n_songs)
+                next_page = None if done else prefetch.submit(self.__inner__next_page,sp,'playlist_items',page)
+
+                # local files and unavailable songs have no spotify id
+                song_ids = [item['track']['id'] for item in items if item['track'] is not None and item['track']['id'] is not None]
+                if song_ids:
+                    yield [song for song in self.get_songs_features(song_ids) if song is not None]
+
+                offset += len(items)
+                if checkpoint is not None:
+                    tmp = f"{checkpoint}.tmp"
+                    with open(tmp,'w') as f:
+                        json.dump({'playlist_id':playlist_id,'offset':offset},f)
+                    os.replace(tmp,checkpoint)
+
+                page = None if next_page is None else next_page.result()
+
+        if checkpoint is not None and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+    def sync_playlist(self,playlist_id,state_dir,as_table=False):
+        """
+        Return a tuple with the songs of a playlist (same as get_playlist_song_features) and a delta record with the changes since the last sync
+        The snapshot id of the playlist and its songs are saved in a json file per playlist, when the snapshot did not change the saved
+        songs are returned with a single request, otherwise only the track ids are read and only the features of the added songs are requested
+        Attributes
+        ----------
+        playlist_id: str - the copy link or id of the playlist
+        state_dir: str - directory of the sync state files (it is created if it does not exist)
+        as_table: boolean - If True, return the songs as a pandas DataFrame with a 'playlist' column instead of the dictionary of lists
+
+        delta record:
+        {
+            'playlist_id': str - the id of the playlist,
+            'name': str - the name of the playlist,
+            'snapshot_id': str - the current snapshot id of the playlist,
+            'previous_snapshot_id': str - the snapshot id of the last sync (None on the first sync),
+            'changed': boolean - False if the playlist did not change since the last sync,
+            'added': [dict,dict,...] - the features of the songs added since the last sync,
+            'removed': [str,str,...] - the ids of the songs removed since the last sync
+        }
+        """
+        if "https" in playlist_id:
+            playlist_id = self.__inner__clean_spotify_id(playlist_id)
+
+        os.makedirs(state_dir,exist_ok=True)
+        path = os.path.join(state_dir,f"{playlist_id}.json")
+        state = {'snapshot_id':None,'songs':[]}
+        if os.path.exists(path):
+            with open(path,encoding='utf-8') as f:
+                state = json.load(f)
+
+        sp = self.__inner__auth_spotify_user_music(self.scope_playlist)
+        playlist_info = self.__inner__request(sp,'playlist',playlist_id,fields='name,snapshot_id')
+
+        DELTA = {'playlist_id':playlist_id,'name':playlist_info['name'],'snapshot_id':playlist_info['snapshot_id'],
+                 'previous_snapshot_id':state['snapshot_id'],'changed':False,'added':[],'removed':[]}
+
+        if playlist_info['snapshot_id'] == state['snapshot_id']:
+            songs = state['songs']
+        else:
+            page = self.__inner__request(sp,'playlist_items',playlist_id,fields='items(track(id)),next',limit=100,additional_types=('track',))
+            # local files and unavailable songs have no spotify id
+            song_ids = [item['track']['id'] for item in self.__inner__get_all_pages(sp,'playlist_items',page) if item['track'] is not None and item['track']['id'] is not None]
+
+            SONGS = {song['id']:song for song in state['songs']}
+            added = [ids for ids in dict.fromkeys(song_ids) if ids not in SONGS]
+            current = set(song_ids)
+
+            DELTA['changed'] = True
+            # songs spotify can not resolve are left out of the playlist
+            ADDED = {ids:song for ids,song in zip(added,self.get_songs_features(added) if added else []) if song is not None}
+            DELTA['added'] = list(ADDED.values())
+            DELTA['removed'] = [ids for ids in SONGS if ids not in current]
+            SONGS.update(ADDED)
+            songs = [SONGS[ids] for ids in song_ids if ids in SONGS]
+
+            tmp = f"{path}.tmp"
+            with open(tmp,'w',encoding='utf-8') as f:
+                json.dump({'playlist_id':playlist_id,'name':playlist_info['name'],'snapshot_id':playlist_info['snapshot_id'],'songs':songs},f)
+            os.replace(tmp,path)
+
+        PLAYLISTS = defaultdict(list)
+        PLAYLISTS[playlist_info['name']].extend(songs)
+        if as_table:
+            return songs_to_table(PLAYLISTS,group='playlist'),DELTA
+        return PLAYLISTS,DELTA
+
     def get_song_music_genre(self,song_id):
         """
-        Return a list with all the genres of the song from spotify
+        Return a list with all the genres of the song from spotify (None if spotify has no song with that id)
         Attributes
         ----------
         song_id: str - the copy link or id of the song 
         """
-        if "https" in song_id:
-            song_id = self.__inner__clean_spotify_id(song_id)
-        
-        sp = self.__inner__auth_spotify_music()
+        return self.get_songs_music_genres([song_id])[0]
 
-        song = sp.track(song_id)
-        album = sp.album(song['album']['id'])
-        artist = sp.artist(song['artists'][0]['id'])
+    def get_songs_music_genres(self,song_ids):
+        """
+        Return a list with the genres list of every song from spotify (same order as the input)
+        The genres of a song are the genres of its album, or the genres of its first artist if the album has none.
+        Songs, albums and artists are requested in batches and every album and artist is only requested once
+        Ids that spotify can not resolve get None and are not cached
+        Attributes
+        ----------
+        song_ids: [str,str,...] - the copy links or ids of the songs
+        """
+        song_ids = [self.__inner__clean_spotify_id(ids) if "https" in ids else ids for ids in song_ids]
+        unique_ids = list(dict.fromkeys(song_ids))
 
-        if len(album['genres'])<1:
-            genre = artist['genres']
-        else:
-            genre = album['genres']
-        return genre
+        GENRES = self.cache.get_many('genres',unique_ids) if self.cache is not None else {}
+        missing = [ids for ids in unique_ids if ids not in GENRES]
+        if not missing:
+            return [GENRES[ids] for ids in song_ids]
+
+        sp = self.__inner__auth_spotify_music()
+        songs = self.__inner__fetch_many(sp,'tracks',missing,self.tracks_batch_size,field='tracks')
+        # spotify answers null for the ids it can not resolve
+        songs = {ids:song for ids,song in songs.items() if song is not None}
+
+        album_ids = list(dict.fromkeys(song['album']['id'] for song in songs.values()))
+        album_genres = self.__inner__get_genres(sp,'albums',album_ids,self.albums_batch_size)
+
+        # artists are only requested for the songs whose album has no genres
+        artist_ids = list(dict.fromkeys(song['artists'][0]['id'] for song in songs.values() if len(album_genres[song['album']['id']])<1))
+        artist_genres = self.__inner__get_genres(sp,'artists',artist_ids,self.tracks_batch_size)
+
+        fetched = {}
+        for ids,song in songs.items():
+            genre = album_genres[song['album']['id']]
+            if len(genre)<1:
+                genre = artist_genres[song['artists'][0]['id']]
+            fetched[ids] = genre
+        GENRES.update(fetched)
+        if self.cache is not None and fetched:
+            self.cache.put_many('genres',fetched)
+
+        return [GENRES.get(ids) for ids in song_ids]
+
+    def __inner__get_genres(self,sp,kind,object_ids,batch_size):
+        """
+        Return a dictionary with the genres of albums or artists, looking first in the genres memo of the downloader
+        Attributes
+        ----------
+        sp: object - the spotify API client
+        kind: str - the type of object (available are albums and artists)
+        object_ids: [str,str,...] - the spotify ids of the albums or artists
+        batch_size: int - max number of ids per request
+        """
+        memo = self.genres_memo.get_many([(kind,ids) for ids in object_ids]) if self.genres_memo is not None else {}
+        GENRES = {ids:memo[(kind,ids)] for ids in object_ids if (kind,ids) in memo}
+
+        missing = [ids for ids in object_ids if ids not in GENRES]
+        objects = self.__inner__fetch_many(sp,kind,missing,batch_size,field=kind)
+        fetched = {ids:obj['genres'] for ids,obj in objects.items()}
+        GENRES.update(fetched)
+        if self.genres_memo is not None:
+            self.genres_memo.put_many({(kind,ids):genre for ids,genre in fetched.items()})
+        return GENRES
+
+    def __inner__genius(self):
+        """
+        Return the genius API client, created once and reused by every lyrics request of the downloader
+        """
+        with self.__lock:
+            if self.__genius is None:
+                # lyricsgenius (and beautifulsoup) is only imported when lyrics are requested
+                import lyricsgenius
+                genius = lyricsgenius.Genius(self.genius_acess_token)
+                genius.remove_section_headers = True
+                genius.verbose = False
+                # lyricsgenius sleeps after every request, the requests are throttled by the limiter of the downloader instead
+                genius.sleep_time = 0
+                session_request = genius._session.request
+
+                def request(method,url,**kwargs):
+                    endpoint = 'genius_api' if url.startswith((genius.API_ROOT,genius.PUBLIC_API_ROOT)) else 'genius_web'
+
+                    def call():
+                        response = session_request(method,url,**kwargs)
+                        return response,response.status_code,response.headers
+
+                    return self.__inner__throttled(endpoint,call)
+
+                # every request of the client (search and lyrics page) shares the rate limit, the requests in flight and the retries of the spotify requests
+                genius._session.request = request
+                self.__genius = genius
+        return self.__genius
+
+    def __inner__lyrics_key(self,songname,artistname):
+        """
+        Return the normalized (lowercase, without accents and extra spaces) key of a song used by the lyrics cache
+        Attributes
+        ----------
+        songname: str - the name of the song
+        artistname: str - the name of the artist's song
+        """
+        names = []
+        for name in (songname,artistname):
+            name = unicodedata.normalize('NFKD',name)
+            name = "".join(char for char in name if not unicodedata.combining(char))
+            names.append(" ".join(name.lower().split()))
+        return " | ".join(names)
 
     def get_song_lyrics(self,songname,artistname):
         """
-        Return a string with the lyrics  of the song from genius
+        Return a string with the lyrics  of the song from genius (None if genius has no lyrics for the song)
         Attributes
         ----------
         songname: str - the name of the song
         artistname: str - the name of the artist's song
         """
-        genius = lyricsgenius.Genius(self.genius_acess_token)
-        genius.remove_section_headers = True
-        song = genius.search_song(songname,artistname)
-        return song.lyrics
+        return self.get_songs_lyrics([(songname,artistname)])[0]
+
+    def get_songs_lyrics(self,songs):
+        """
+        Return a list with the lyrics of every song from genius (same order as the input, None if genius has no lyrics for the song)
+        The songs are searched concurrently (max_workers) with a single genius client. When the downloader has a cache
+        the lyrics and the songs without lyrics are stored in it, so they are not searched again
+        Attributes
+        ----------
+        songs: [(str,str),...] - list of tuples with the name of the song and the name of the artist's song
+        """
+        keys = [self.__inner__lyrics_key(songname,artistname) for songname,artistname in songs]
+        queries = dict(zip(keys,songs))
+
+        LYRICS = {}
+        if self.cache is not None:
+            LYRICS.update({key:None for key in self.cache.get_many('lyrics_misses',list(queries))})
+            LYRICS.update(self.cache.get_many('lyrics',[key for key in queries if key not in LYRICS]))
+
+        genius = self.__inner__genius()
+
+        def search(key):
+            songname,artistname = queries[key]
+            try:
+                song = genius.search_song(songname,artistname,get_full_info=False)
+            except Exception as e:
+                # failed requests are not cached as misses, they are searched again the next time
+                print(f"Lyrics of {songname} - {artistname} could not be downloaded: {e}")
+                return False
+            return None if song is None else song.lyrics
+
+        missing = [key for key in queries if key not in LYRICS]
+        fetched = dict(zip(missing,self.__inner__map(search,missing)))
+        fetched = {key:lyric for key,lyric in fetched.items() if lyric is not False}
+        LYRICS.update(fetched)
+
+        if self.cache is not None:
+            self.cache.put_many('lyrics',{key:lyric for key,lyric in fetched.items() if lyric is not None})
+            self.cache.put_many('lyrics_misses',{key:True for key,lyric in fetched.items() if lyric is None})
+
+        return [LYRICS.get(key) for key in keys]
 
     
     def get_artist_information(self,artist):
@@ -308,7 +849,7 @@ class SpotiScienceDownloader():
         artist: str - the name of the artist
         """
         sp = self.__inner__auth_spotify_user_music(self.scope_user_modify)
-        artist = sp.search(q=artist,type='artist',limit=1)
+        artist = self.__inner__request(sp,'search',q=artist,type='artist',limit=1)
         return artist
 
 
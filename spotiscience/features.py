@@ -0,0 +1,228 @@
+"""
+This module implements the helpers shared by the models that work with the song features matrix
+Author: Cristóbal Veas
+Linkedln: https://www.linkedin.com/in/cristobal-veas/
+"""
+
+__author__ = "Cristóbal Veas"
+__email__ = "cristobal.veas.ch@gmail.com"
+__status__ = "planning"
+
+from itertools import islice
+import numpy as np
+
+# keys of the song dictionaries returned by SpotiScienceDownloader, in order
+SONG_KEYS = ['id','name','artist','album','release_date','popularity','length',
+             'acousticness','danceability','energy','instrumentalness','liveness',
+             'valence','loudness','speechiness','tempo','key','time_signature']
+
+# compact column types of the song tables (nullable integers, a song may have no audio features)
+SONG_DTYPES = {'id':'string','name':'category','artist':'category','album':'category','release_date':'category',
+               'popularity':'Int16','length':'Int32',
+               'acousticness':'float32','danceability':'float32','energy':'float32','instrumentalness':'float32',
+               'liveness':'float32','valence':'float32','loudness':'float32','speechiness':'float32','tempo':'float32',
+               'key':'Int16','time_signature':'Int16'}
+
+
+def is_table(songs):
+    """
+    Return True if the songs are a columnar table (pandas DataFrame) instead of song dictionaries
+    """
+    return hasattr(songs,'columns')
+
+
+def is_row(songs):
+    """
+    Return True if the songs are a single row of a table (pandas Series), for example table.iloc[0]
+    """
+    return hasattr(songs,'to_frame') and not is_table(songs)
+
+
+def songs_to_table(songs,group=None):
+    """
+    Return a pandas DataFrame with one row per song and compact column types (float32 and int16 features, categorical strings)
+    Attributes
+    ----------
+    songs: dict or list - a single song, a list of songs or a dictionary of lists of songs (output of the album and playlist downloaders)
+    group: str - name of a categorical column holding the dictionary key of every song (default is None, no column is added)
+    """
+    import pandas as pd
+
+    if isinstance(songs,dict) and 'id' not in songs:
+        groups = [(key,songs[key]) for key in songs.keys()]
+    else:
+        groups = [(None,list(iter_songs(songs)))]
+
+    columns = {key:[song[key] for _,group_songs in groups for song in group_songs] for key in SONG_KEYS}
+    table = pd.DataFrame(columns,columns=SONG_KEYS)
+    # float to float32 through float64 so the None of songs without audio features become nan
+    table = table.astype({key:'float64' for key,dtype in SONG_DTYPES.items() if dtype == 'float32'}).astype(SONG_DTYPES)
+    if group is not None:
+        table.insert(0,group,pd.Categorical([key for key,group_songs in groups for _ in group_songs]))
+    return table
+
+
+def as_collection(songs):
+    """
+    Return the songs as a table or a list of song dictionaries, so they can be sized and sliced
+    Attributes
+    ----------
+    songs: dict or list or DataFrame or Series - the collection of songs (see iter_songs), a row of a table is a table with one song
+    """
+    if is_row(songs):
+        return songs.to_frame().T.infer_objects()
+    if is_table(songs):
+        return songs
+    return list(iter_songs(songs))
+
+
+def column(songs,key):
+    """
+    Return a list with the values of a key for every song
+    Attributes
+    ----------
+    songs: list or DataFrame - the songs
+    key: str - the song key
+    """
+    if is_table(songs):
+        return songs[key].tolist()
+    return [song[key] for song in songs]
+
+
+def iter_songs(songs):
+    """
+    Return an iterator over the song dictionaries of a collection
+    Attributes
+    ----------
+    songs: dict or list - a single song, a list of songs or a dictionary of lists of songs (output of the album and playlist downloaders)
+    """
+    if isinstance(songs,dict) and 'id' in songs:
+        yield songs
+    elif isinstance(songs,dict):
+        for key in songs.keys():
+            yield from songs[key]
+    else:
+        yield from songs
+
+
+def iter_chunks(songs,chunk_size):
+    """
+    Return an iterator over lists of at most chunk_size songs of a collection
+    Attributes
+    ----------
+    songs: dict or list or DataFrame - the collection of songs (see as_collection), tables are split in tables
+    chunk_size: int - max number of songs per chunk
+    """
+    if is_row(songs):
+        songs = as_collection(songs)
+    if is_table(songs):
+        for i in range(0,len(songs),chunk_size):
+            yield songs.iloc[i:i+chunk_size]
+        return
+    songs = iter_songs(songs)
+    while True:
+        chunk = list(islice(songs,chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def feature_matrix(songs,keys):
+    """
+    Return a float matrix with one row per song and one column per feature key (missing features are nan)
+    Attributes
+    ----------
+    songs: list or DataFrame or Series - the song dictionaries, a table of songs or a row of a table
+    keys: list - the feature keys used as columns
+    """
+    if is_row(songs):
+        songs = as_collection(songs)
+    if is_table(songs):
+        return songs[list(keys)].to_numpy(dtype=np.float64,na_value=np.nan)
+    return np.array([[np.nan if song[key] is None else song[key] for key in keys] for song in songs],dtype=np.float64).reshape(-1,len(keys))
+
+
+def normalize(matrix):
+    """
+    Return the matrix with every row divided by the sum of its values
+    Attributes
+    ----------
+    matrix: np.array - the features matrix
+    """
+    return matrix / matrix.sum(axis=1,keepdims=True)
+
+
+def distances(queries,block,distance='l2'):
+    """
+    Return a matrix with the distance between every query row and every block row
+    Attributes
+    ----------
+    queries: np.array - the normalized features of the query songs (n_queries x n_features)
+    block: np.array - the normalized features of the target songs (n_songs x n_features)
+    distance: str - the type of distance (available type are l1 or l2, default is l2)
+    """
+    diff = block[np.newaxis,:,:] - queries[:,np.newaxis,:]
+    if "l1" in distance:
+        return np.abs(diff).sum(axis=2)
+    return np.sqrt(np.einsum('qsf,qsf->qs',diff,diff))
+
+
+def merge_top_n(best_dist,best_idx,dist,idx,top_n):
+    """
+    Return the top_n smallest distances (and their indexes) of every query row merging the current best ones with a new block
+    Ties are broken by the index, so the result does not depend on how the target is split in blocks
+    Attributes
+    ----------
+    best_dist: np.array - the current best distances (n_queries x k)
+    best_idx: np.array - the global indexes of the current best distances (n_queries x k)
+    dist: np.array - the distances of the new block, invalid entries are inf (n_queries x n_block)
+    idx: np.array - the global indexes of the new block rows (n_block)
+    top_n: int - max number of results per query
+    """
+    if dist.shape[1] > top_n:
+        # every entry as near as the kth one is kept, so the ties at the cut are broken by the index and not by the partition
+        kth = np.partition(dist,top_n-1,axis=1)[:,top_n-1:top_n]
+        keep = (dist <= kth) & np.isfinite(dist)
+        counts = keep.sum(axis=1)
+        rows,cols = np.nonzero(keep)
+        positions = np.arange(len(rows)) - np.repeat(np.cumsum(counts)-counts,counts)
+        n_keep = max(top_n,int(counts.max(initial=0)))
+        kept_dist = np.full((dist.shape[0],n_keep),np.inf,dtype=dist.dtype)
+        kept_idx = np.full((dist.shape[0],n_keep),-1,dtype=np.int64)
+        kept_dist[rows,positions] = dist[rows,cols]
+        kept_idx[rows,positions] = idx[cols]
+        dist,idx = kept_dist,kept_idx
+    else:
+        idx = np.broadcast_to(idx,dist.shape)
+    dist = np.concatenate([best_dist,dist],axis=1)
+    idx = np.concatenate([best_idx,idx],axis=1)
+    order = np.lexsort((idx,dist),axis=1)[:,:top_n]
+    return np.take_along_axis(dist,order,axis=1),np.take_along_axis(idx,order,axis=1)
+
+
+def exclude_names(dist,object_names,target_names,top_n,extra=16):
+    """
+    Set to inf the distances of the target songs named like the query songs (the query name is part of the target name) and return the matrix
+    Only the top_n+extra nearest targets of every query row are checked, rows where too many of them are excluded are checked completely,
+    so the top_n smallest distances are the same as checking every target
+    Attributes
+    ----------
+    dist: np.array - the distances of the block, invalid entries are inf (n_queries x n_block)
+    object_names: list - the names of the query songs
+    target_names: sequence - the names of the block songs, only the checked rows are read
+    top_n: int - max number of results per query
+    extra: int - number of checked targets per query besides the top_n (default is 16)
+    """
+    n_candidates = min(dist.shape[1],top_n+extra)
+    if n_candidates == 0:
+        return dist
+    kth = np.partition(dist,n_candidates-1,axis=1)[:,n_candidates-1]
+    for q,name in enumerate(object_names):
+        row = dist[q]
+        # every target as near as the kth one is a candidate, so ties do not depend on the partition
+        candidates = np.flatnonzero(row <= kth[q] if np.isfinite(kth[q]) else np.isfinite(row))
+        excluded = [i for i in candidates.tolist() if name in target_names[i]]
+        if np.isfinite(kth[q]) and len(candidates) - len(excluded) < top_n:
+            excluded = [i for i in np.flatnonzero(np.isfinite(row)).tolist() if name in target_names[i]]
+        row[excluded] = np.inf
+    return dist
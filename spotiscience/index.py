@@ -0,0 +1,230 @@
+"""
+This module implements a persistent index for song similarity searches over large catalogs
+Author: Cristóbal Veas
+Linkedln: https://www.linkedin.com/in/cristobal-veas/
+"""
+
+__author__ = "Cristóbal Veas"
+__email__ = "cristobal.veas.ch@gmail.com"
+__status__ = "planning"
+
+from collections import defaultdict
+import json
+import mmap
+import os
+import numpy as np
+from spotiscience.features import SONG_KEYS, as_collection, column, iter_chunks, feature_matrix, normalize, distances, merge_top_n
+
+
+class SimilarityIndex():
+    """
+    Class for searching similar songs in a prebuilt index.
+    The normalized song features are stored as a float64 matrix in a memory-mapped file, so several processes
+    can query the same index without copying it, and the songs are searched by blocks of rows.
+    The features are dominated by the length of the songs once normalized, so they are kept in float64 to rank the songs
+    like predict_similar_songs (indexes built with float32 features can still be queried, their distances are approximate).
+    The id, name and artist of the songs are also memory-mapped, only the rows of the results (and the names of the nearest candidates) are decoded.
+    Attributes
+    ----------
+    path: str - directory where the index files are stored (it is created if it does not exist)
+    n_features: int - position of the first song key used as feature (default is 6, ignored when the index already exists)
+    block_size: int - max number of songs compared at once (default is 65536)
+
+    files of the index:
+    meta.json: the feature keys, the type of the features and the number of songs of the index
+    features.f64: the normalized features matrix (row-major float64, features.f32 for float32 indexes)
+    songs.jsonl: the id, name and artist of every song (one line per row of the matrix)
+    songs.idx: the offset in bytes of every line of songs.jsonl (int64)
+    """
+
+    def __init__(self,path,n_features=6,block_size=65536):
+        self.path = path
+        self.block_size = block_size
+
+        os.makedirs(path,exist_ok=True)
+        if os.path.exists(self.__inner__file('meta.json')):
+            with open(self.__inner__file('meta.json')) as f:
+                meta = json.load(f)
+            self.keys = meta['keys']
+            self.dtype = np.dtype(meta.get('dtype','float32'))
+        else:
+            self.keys = SONG_KEYS[n_features:]
+            self.dtype = np.dtype(np.float64)
+            self.__inner__write_meta(0,0)
+        self.load()
+
+    def __inner__file(self,name):
+        """
+        Return the path of a file of the index
+        """
+        return os.path.join(self.path,name)
+
+    def __inner__features_file(self):
+        """
+        Return the path of the features file of the index
+        """
+        return self.__inner__file('features.f32' if self.dtype == np.float32 else 'features.f64')
+
+    def __inner__write_meta(self,n_songs,songs_size):
+        """
+        Write the index metadata, it is only updated after the features and songs files were written
+        Attributes
+        ----------
+        n_songs: int - number of songs of the index
+        songs_size: int - size in bytes of the songs file
+        """
+        tmp = self.__inner__file('meta.json.tmp')
+        with open(tmp,'w') as f:
+            json.dump({'keys':self.keys,'dtype':self.dtype.name,'n_songs':n_songs,'songs_size':songs_size},f)
+        os.replace(tmp,self.__inner__file('meta.json'))
+
+    def load(self):
+        """
+        (Re)open the index files, used to see the songs added by other processes
+        """
+        with open(self.__inner__file('meta.json')) as f:
+            meta = json.load(f)
+        n_songs = meta['n_songs']
+        self.songs_size = meta['songs_size']
+
+        if n_songs > 0:
+            self.matrix = np.memmap(self.__inner__features_file(),dtype=self.dtype,mode='r',shape=(n_songs,len(self.keys)))
+        else:
+            self.matrix = np.empty((0,len(self.keys)),dtype=self.dtype)
+
+        self.offsets = np.empty(0,dtype=np.int64)
+        self.songs_map = b""
+        if n_songs > 0:
+            offsets_file = self.__inner__file('songs.idx')
+            if not os.path.exists(offsets_file) or os.path.getsize(offsets_file) < n_songs*np.dtype(np.int64).itemsize:
+                self.__inner__write_offsets(n_songs)
+            self.offsets = np.memmap(offsets_file,dtype=np.int64,mode='r',shape=(n_songs,))
+            with open(self.__inner__file('songs.jsonl'),'rb') as f:
+                self.songs_map = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+
+    def __inner__write_offsets(self,n_songs):
+        """
+        Write the offsets file of an index built without it, reading the songs file once
+        Attributes
+        ----------
+        n_songs: int - number of songs of the index
+        """
+        offsets = np.empty(n_songs,dtype=np.int64)
+        position = 0
+        with open(self.__inner__file('songs.jsonl'),'rb') as f:
+            for n,line in zip(range(n_songs),f):
+                offsets[n] = position
+                position += len(line)
+        tmp = self.__inner__file('songs.idx.tmp')
+        offsets.tofile(tmp)
+        os.replace(tmp,self.__inner__file('songs.idx'))
+
+    def song(self,row):
+        """
+        Return a tuple with the id, name and artist of the song in a row of the index
+        Attributes
+        ----------
+        row: int - the row of the song
+        """
+        start = int(self.offsets[row])
+        end = int(self.offsets[row+1]) if row+1 < len(self.offsets) else self.songs_size
+        return tuple(json.loads(self.songs_map[start:end]))
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @classmethod
+    def build(cls,path,songs,n_features=6,block_size=65536):
+        """
+        Return a new index with the songs of a collection
+        Attributes
+        ----------
+        path: str - directory where the index files are stored
+        songs: dict or list - the data of the songs (output of the song, album or playlist downloaders or a songs table)
+        n_features: int - position of the first song key used as feature (default is 6)
+        block_size: int - max number of songs compared at once (default is 65536)
+        """
+        index = cls(path,n_features=n_features,block_size=block_size)
+        index.add(songs)
+        return index
+
+    def add(self,songs):
+        """
+        Append songs to the index
+        Attributes
+        ----------
+        songs: dict or list - the data of the songs (output of the song, album or playlist downloaders or a songs table)
+        """
+        n_songs = len(self)
+        songs_size = self.songs_size
+        with open(self.__inner__features_file(),'ab') as features, open(self.__inner__file('songs.jsonl'),'ab') as songs_file, \
+             open(self.__inner__file('songs.idx'),'ab') as offsets_file:
+            # drop anything written after the last committed song by an interrupted add
+            features.truncate(n_songs*len(self.keys)*self.dtype.itemsize)
+            songs_file.truncate(songs_size)
+            offsets_file.truncate(n_songs*np.dtype(np.int64).itemsize)
+            for chunk in iter_chunks(songs,self.block_size):
+                matrix = normalize(feature_matrix(chunk,self.keys)).astype(self.dtype)
+                features.write(np.ascontiguousarray(matrix).tobytes())
+                lines = [(json.dumps(song)+"\n").encode('utf-8') for song in zip(column(chunk,'id'),column(chunk,'name'),column(chunk,'artist'))]
+                lengths = np.array([len(line) for line in lines],dtype=np.int64)
+                offsets_file.write((songs_size + np.cumsum(lengths) - lengths).tobytes())
+                songs_file.write(b"".join(lines))
+                songs_size += int(lengths.sum())
+                n_songs += len(chunk)
+        self.__inner__write_meta(n_songs,songs_size)
+        self.load()
+
+    def __inner__nearest(self,queries,distance,n):
+        """
+        Return the n smallest distances (and their rows) of every query searching the index by blocks, songs identical to the query are left out
+        Attributes
+        ----------
+        queries: np.array - the normalized features of the query songs
+        distance: str - the type of distance (available type are l1 or l2)
+        n: int - max number of results per query
+        """
+        best_dist = np.empty((len(queries),0),dtype=np.float64)
+        best_idx = np.empty((len(queries),0),dtype=np.int64)
+
+        block_size = max(1,self.block_size//max(1,len(queries)))
+        for start in range(0,len(self),block_size):
+            block = np.asarray(self.matrix[start:start+block_size],dtype=np.float64)
+            dist = distances(queries,block,distance)
+            dist[~(dist > 0)] = np.inf
+            best_dist,best_idx = merge_top_n(best_dist,best_idx,dist,np.arange(start,start+len(block)),n)
+        return best_dist,best_idx
+
+    def query(self,object,distance='l2',top_n=10):
+        """
+        Return a dictionary where the keys are the names of the query songs and the values lists of (name, artist, distance) of the most similar songs
+        Attributes
+        ----------
+        object: dict [dict,dict,...] - the data of the song to analyze (it could be a single song, a list of songs or a songs table)
+        distance: str - the type of distance (available type are l1 or l2, default is l2)
+        top_n: int - number of most similar songs returns as result (default is 10)
+        """
+        similar_songs = defaultdict(list)
+
+        objects = as_collection(object)
+        object_names = column(objects,'name')
+        queries = normalize(feature_matrix(objects,self.keys))
+
+        # songs named like the object are not similar songs, the names are only read for the nearest songs of every query
+        # and the queries with too many of them named like the object are searched again with more candidates
+        pending = list(range(len(objects)))
+        n_candidates = top_n + 16
+        while pending:
+            best_dist,best_idx = self.__inner__nearest(queries[pending],distance,n_candidates)
+            retry = []
+            for n,dist,rows in zip(pending,best_dist,best_idx.tolist()):
+                name = object_names[n]
+                found = [self.song(i)[1:]+(float(d),) for d,i in zip(dist,rows) if np.isfinite(d)]
+                songs = [song for song in found if name not in song[0]]
+                if len(songs) < top_n and len(found) == n_candidates:
+                    retry.append(n)
+                else:
+                    similar_songs[name] = songs[:top_n]
+            pending = retry
+            n_candidates *= 4
+        return similar_songs
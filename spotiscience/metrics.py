@@ -0,0 +1,223 @@
+"""
+This module implements the instrumentation of the downloader and the predicter
+Author: Cristóbal Veas
+Linkedln: https://www.linkedin.com/in/cristobal-veas/
+"""
+
+__author__ = "Cristóbal Veas"
+__email__ = "cristobal.veas.ch@gmail.com"
+__status__ = "planning"
+
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import nullcontext
+import threading
+import time
+
+# context returned by timer when the instrumentation is disabled
+_NULL_TIMER = nullcontext()
+
+
+def timer(metrics,name,**labels):
+    """
+    Return a context measuring the seconds of its block in a histogram of the metrics (it does nothing if metrics is None)
+    Attributes
+    ----------
+    metrics: Metrics - the metrics registry or None
+    name: str - the name of the histogram
+    **labels - the labels of the sample
+    """
+    if metrics is None:
+        return _NULL_TIMER
+    return _Timer(metrics,name,labels)
+
+
+class _Timer():
+    """
+    Context measuring the seconds of its block, see timer
+    """
+
+    def __init__(self,metrics,name,labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self,*exc):
+        self.metrics.observe(self.name,time.perf_counter()-self.start,**self.labels)
+        return False
+
+
+class Metrics():
+    """
+    Class for recording the counters and latency histograms of the downloader and the predicter.
+    The instrumented classes take a metrics attribute (default is None), when it is None nothing is measured.
+    Attributes
+    ----------
+    prefix: str - prefix of the metric names in the prometheus export (default is 'spotiscience')
+    buckets: tuple - upper bounds in seconds of the histogram buckets (default is DEFAULT_BUCKETS)
+    callbacks: list - functions called with (kind, name, value, labels) on every record, kind is 'counter' or 'histogram' (default is None)
+
+    metrics recorded:
+    api_requests_total{endpoint,status}: counter - spotify and genius requests (every attempt, status 0 is a request failed without response, genius endpoints are genius_api and genius_web)
+    api_request_seconds{endpoint}: histogram - latency of the requests
+    api_retries_total{endpoint,status}: counter - requests retried after a 429 or 5xx response
+    api_rate_limited_total{endpoint}: counter - 429 responses
+    throttle_seconds_total{reason}: counter - seconds slept by the rate limiter (rate_limit) and between retries (backoff)
+    auth_seconds{flow}: histogram - token requests and refreshes (client_credentials or oauth)
+    cache_hits_total{group}, cache_misses_total{group}: counter - lookups of the SpotiScienceCache
+    stage_seconds{stage}: histogram - stages of the topic models (tokenize, vectorize, fit, topics, transform)
+    """
+    DEFAULT_BUCKETS = (0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0,30.0)
+
+    def __init__(self,prefix='spotiscience',buckets=None,callbacks=None):
+        self.prefix = prefix
+        self.buckets = tuple(sorted(buckets)) if buckets is not None else self.DEFAULT_BUCKETS
+        self.callbacks = list(callbacks) if callbacks is not None else []
+
+        self.__lock = threading.Lock()
+        self.__counters = defaultdict(float)
+        self.__histograms = {}
+
+    def add_callback(self,callback):
+        """
+        Add a function called with (kind, name, value, labels) on every record
+        Attributes
+        ----------
+        callback: callable - the function
+        """
+        self.callbacks.append(callback)
+
+    def inc(self,name,value=1,**labels):
+        """
+        Increase a counter
+        Attributes
+        ----------
+        name: str - the name of the counter
+        value: float - the increase (default is 1)
+        **labels - the labels of the sample
+        """
+        key = (name,tuple(sorted(labels.items())))
+        with self.__lock:
+            self.__counters[key] += value
+        for callback in self.callbacks:
+            callback('counter',name,value,labels)
+
+    def observe(self,name,value,**labels):
+        """
+        Record a value (usually seconds) in a histogram
+        Attributes
+        ----------
+        name: str - the name of the histogram
+        value: float - the observed value
+        **labels - the labels of the sample
+        """
+        key = (name,tuple(sorted(labels.items())))
+        with self.__lock:
+            histogram = self.__histograms.get(key)
+            if histogram is None:
+                histogram = self.__histograms[key] = {'counts':[0]*(len(self.buckets)+1),'sum':0.0,'count':0}
+            histogram['counts'][bisect_left(self.buckets,value)] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+        for callback in self.callbacks:
+            callback('histogram',name,value,labels)
+
+    def timer(self,name,**labels):
+        """
+        Return a context measuring the seconds of its block in a histogram
+        Attributes
+        ----------
+        name: str - the name of the histogram
+        **labels - the labels of the sample
+        """
+        return _Timer(self,name,labels)
+
+    def timed(self,iterable,name,**labels):
+        """
+        Return an iterator over the items of an iterable measuring the seconds spent producing every item
+        Attributes
+        ----------
+        iterable: iterable - the iterable, usually a generator doing the work lazily
+        name: str - the name of the histogram
+        **labels - the labels of the sample
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.observe(name,time.perf_counter()-start,**labels)
+            yield item
+
+    def reset(self):
+        """
+        Remove every recorded value
+        """
+        with self.__lock:
+            self.__counters.clear()
+            self.__histograms.clear()
+
+    def to_dict(self):
+        """
+        Return a dictionary with the recorded metrics
+        {
+            'counters': {name: [{'labels': dict, 'value': float},...]},
+            'histograms': {name: [{'labels': dict, 'count': int, 'sum': float, 'buckets': {upper bound: cumulative count}},...]}
+        }
+        """
+        with self.__lock:
+            counters = list(self.__counters.items())
+            histograms = [(key,{'counts':list(value['counts']),'sum':value['sum'],'count':value['count']}) for key,value in self.__histograms.items()]
+
+        COUNTERS = defaultdict(list)
+        for (name,labels),value in sorted(counters):
+            COUNTERS[name].append({'labels':dict(labels),'value':value})
+
+        HISTOGRAMS = defaultdict(list)
+        for (name,labels),histogram in sorted(histograms,key=lambda item: item[0]):
+            cumulative = 0
+            buckets = {}
+            for bound,count in zip(self.buckets+(float('inf'),),histogram['counts']):
+                cumulative += count
+                buckets[bound] = cumulative
+            HISTOGRAMS[name].append({'labels':dict(labels),'count':histogram['count'],'sum':histogram['sum'],'buckets':buckets})
+
+        return {'counters':dict(COUNTERS),'histograms':dict(HISTOGRAMS)}
+
+    def to_prometheus(self):
+        """
+        Return a string with the recorded metrics in the prometheus text exposition format
+        """
+        def labels_text(labels):
+            if not labels:
+                return ""
+            values = ",".join('%s="%s"' % (key,str(value).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')) for key,value in labels.items())
+            return "{%s}" % values
+
+        def number(value):
+            if value == float('inf'):
+                return "+Inf"
+            if float(value).is_integer():
+                return str(int(value))
+            return repr(float(value))
+
+        metrics = self.to_dict()
+        lines = []
+        for name,samples in metrics['counters'].items():
+            lines.append(f"# TYPE {self.prefix}_{name} counter")
+            for sample in samples:
+                lines.append(f"{self.prefix}_{name}{labels_text(sample['labels'])} {number(sample['value'])}")
+        for name,samples in metrics['histograms'].items():
+            lines.append(f"# TYPE {self.prefix}_{name} histogram")
+            for sample in samples:
+                for bound,count in sample['buckets'].items():
+                    lines.append(f"{self.prefix}_{name}_bucket{labels_text({**sample['labels'],'le':number(bound)})} {count}")
+                lines.append(f"{self.prefix}_{name}_sum{labels_text(sample['labels'])} {number(sample['sum'])}")
+                lines.append(f"{self.prefix}_{name}_count{labels_text(sample['labels'])} {sample['count']}")
+        return "\n".join(lines) + "\n"
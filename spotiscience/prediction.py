@@ -10,16 +10,177 @@ __status__ = "planning"
 
 
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+import hashlib
+import json
+import os
+import threading
+import time
+from importlib import resources
 import numpy as np 
-import spacy
-from spacy.lang.en.stop_words import STOP_WORDS as SWE
-from spacy.lang.es.stop_words import STOP_WORDS as SWS
 import string
-from sklearn.decomposition import NMF, LatentDirichletAllocation, TruncatedSVD
-from sklearn.feature_extraction.text import CountVectorizer
 from collections import defaultdict
-import joblib
-import pkg_resources
+from spotiscience.features import SONG_KEYS, is_table, is_row, as_collection, column, iter_chunks, feature_matrix, normalize, distances, merge_top_n, exclude_names
+from spotiscience.index import SimilarityIndex
+from spotiscience.metrics import timer
+# spacy, scikit-learn and joblib are imported by the functions using them, so importing the module is fast
+
+# spacy pipelines shared by every predicter of the process, keyed by model name
+_PIPELINES = {}
+_PIPELINES_LOCK = threading.Lock()
+# components not used by the tokenizer, only the lemmatizer (and the taggers it depends on) is needed
+_EXCLUDED_PIPES = ['parser','ner','senter','textcat','entity_linker','entity_ruler']
+
+
+def _load_pipeline(name):
+    """
+    Return the spacy pipeline of a model, loading it without the unused components the first time it is requested
+    Attributes
+    ----------
+    name: str - the name or path of the spacy model
+    """
+    with _PIPELINES_LOCK:
+        if name not in _PIPELINES:
+            import spacy
+            _PIPELINES[name] = spacy.load(name,exclude=_EXCLUDED_PIPES)
+        return _PIPELINES[name]
+
+
+# versions of the spacy models, keyed by model name
+_PIPELINE_VERSIONS = {}
+
+
+def _pipeline_version(name):
+    """
+    Return the version of a spacy model without loading it when possible (version of the installed package or of the meta.json of a model directory)
+    Attributes
+    ----------
+    name: str - the name or path of the spacy model
+    """
+    if name not in _PIPELINE_VERSIONS:
+        from importlib import metadata
+        try:
+            version = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            meta = os.path.join(name,'meta.json')
+            if os.path.isfile(meta):
+                with open(meta,encoding='utf-8') as f:
+                    version = json.load(f).get('version')
+            else:
+                version = _load_pipeline(name).meta.get('version')
+        _PIPELINE_VERSIONS[name] = str(version)
+    return _PIPELINE_VERSIONS[name]
+
+
+# mood models shared by every predicter of the process, keyed by path and mmap mode
+_MODELS = {}
+_MODELS_LOCK = threading.Lock()
+
+
+def _load_model(path,mmap_mode=None):
+    """
+    Return the joblib model stored in a path, deserializing it only the first time it is requested
+    Attributes
+    ----------
+    path: str - the path of the joblib file
+    mmap_mode: str - the joblib mmap mode used to load the numpy arrays of the model (None, 'r' or 'c')
+    """
+    with _MODELS_LOCK:
+        if (path,mmap_mode) not in _MODELS:
+            import joblib
+            _MODELS[(path,mmap_mode)] = joblib.load(path,mmap_mode=mmap_mode)
+        return _MODELS[(path,mmap_mode)]
+
+
+def _lyric_vectorizer(lyrics,stop_words,n_grams,min_df=1,max_df=0.9):
+    """
+    vectorize the lyrics returning the vectorizer object and a list with the vectorized lyrics
+    Attributes
+    ----------
+    lyrics: list - a list with sentences of lyric.
+    stop_words: str - the language used for vectorizer stop words 
+    n_grams: tuple - the number of n-grams used for vectorizer  model  (1gram: (1,1) ,  1 or 2 gram (1,2))
+    min_df, max_df: int or float - the min and max document frequency of the vectorizer words (default is 1 and 0.9)
+
+    see more info about stop_words and n_grams parameters in sklearn documentation
+    https://scikit-learn.org/stable/modules/generated/sklearn.feature_extraction.text.CountVectorizer.html
+    """
+    from sklearn.feature_extraction.text import CountVectorizer
+
+    vectorizer = CountVectorizer(min_df=min_df, max_df=max_df, stop_words=stop_words, token_pattern='[a-zA-Z\-][a-zA-Z\-]{2,}',ngram_range=n_grams)
+    lyrics_vectorized = vectorizer.fit_transform(lyrics)
+    return vectorizer,lyrics_vectorized
+
+
+def _train_model(lyrics_vectorized,modelname,num_topics):
+    """
+    train the topic modelling model
+    Attributes
+    ----------
+    lyrics_vectorized: list -  the song lyrics vectorized 
+    modelname: str - the name of the model used for Topic MOdelling (available options are "lda","nmf" and "lsi")
+    num_topics: int - the number of topics for the model 
+    """
+    from sklearn.decomposition import NMF, LatentDirichletAllocation, TruncatedSVD
+
+    if "lda" in modelname:
+        # Latent Dirichlet Allocation Model
+        model = LatentDirichletAllocation(n_components=num_topics, max_iter=10, learning_method='online',verbose=False)
+    if "nmf" in modelname:
+    # Non-Negative Matrix Factorization Model
+        model = NMF(n_components=num_topics)
+    if "lsi" in modelname:
+        # Latent Semantic Indexing Model using Truncated SVD
+        model = TruncatedSVD(n_components=num_topics)
+    model.fit(lyrics_vectorized)
+    return model 
+
+
+def _selected_topics(model, vectorizer, top_n):
+    """
+    Predict the topics using vectorizer model and topic modelling model 
+    The top words of every topic are selected at once with a partial sort of the model components
+    Attributes
+    ----------
+    model: object - the trained topic modelling model
+    vectorizer: object -  the trained vectorizer model 
+    top_n: int - the max number of words per topic
+    """
+    if hasattr(vectorizer,'get_feature_names_out'):
+        feature_names = np.asarray(vectorizer.get_feature_names_out())
+    else:
+        feature_names = np.asarray(vectorizer.get_feature_names())
+
+    components = model.components_
+    top_n = min(top_n,components.shape[1])
+    top = np.argpartition(-components,top_n-1,axis=1)[:,:top_n]
+    top = np.take_along_axis(top,np.argsort(-np.take_along_axis(components,top,axis=1),axis=1,kind='stable'),axis=1)
+
+    RESULTS = defaultdict(list)
+    for idx,(words,weights) in enumerate(zip(feature_names[top],np.take_along_axis(components,top,axis=1))):
+        n_topic = "Topic %d:" % (idx)
+        RESULTS[n_topic].append(list(zip(words.tolist(),weights.tolist())))
+    return RESULTS
+
+
+def _lyric_topics(processed_lyric,model,stopwords,n_grams,n_topics,top_n):
+    """
+    Return a tuple with the topics of a tokenized lyric training a topic model over its sentences (run by the process pool of predict_topic_lyrics)
+    and a dictionary with the seconds of every stage (vectorize, fit and topics), measured here so they also come back from the pool workers
+    Attributes
+    ----------
+    processed_lyric: list - the tokenized sentences of the lyric
+    model, stopwords, n_grams, n_topics, top_n - same as SpotiSciencePredicter.predict_topic_lyric
+    """
+    start = time.perf_counter()
+    vectorizer, data_vectorized = _lyric_vectorizer(processed_lyric,stop_words=stopwords,n_grams=n_grams)
+    vectorized = time.perf_counter()
+    trained_model = _train_model(data_vectorized,modelname=model,num_topics=n_topics)
+    trained = time.perf_counter()
+    topics = _selected_topics(trained_model,vectorizer,top_n=top_n)
+    return topics,{'vectorize':vectorized-start,'fit':trained-vectorized,'topics':time.perf_counter()-trained}
 
 
 class SpotiSciencePredicter():
@@ -29,19 +190,68 @@ class SpotiSciencePredicter():
     Attributes
     ----------
     STOPWORDS: list - list of english stop words (words which are filtered out before or after processing of natural language text)
-    NLP: object - natural language processing object used in spacy library
+    NLP: object - natural language processing object used in spacy library (loaded on first use and shared by the predicters of the process)
     PUNTUACTION: list - list of  text symbols 
     PATHMODEL: str  path for multi class classification model weights  using a random forest classifier
+    english_model: str - name of the spacy english model (default is 'en_core_web_lg', smaller models like 'en_core_web_sm' are faster to load)
+    spanish_model: str - name of the spacy spanish model (default is 'es_core_news_lg', smaller models like 'es_core_news_sm' are faster to load)
+    mmap_mode: str - joblib mmap mode used to load the mood model, with 'r' forked workers share the model arrays (default is None)
+    metrics: Metrics - registry where the seconds of the topic modelling stages are recorded (default is None, nothing is recorded)
+    cache: SpotiScienceCache - cache of the tokenized lyrics, keyed by a hash of the lyric, the language, the spacy model and its version and the stop words,
+           so repeated runs skip the cleaning and the lemmatization of lyrics already tokenized (default is None, lyrics are always tokenized)
     """
 
-    def __init__(self):
-        self.STOPWORDSENGLISH = list(SWE)
-        self.STOPWORDSSPANISH = list(SWS)
+    def __init__(self,english_model='en_core_web_lg',spanish_model='es_core_news_lg',mmap_mode=None,metrics=None,cache=None):
+        # stop words of spacy, loaded on first use (see the STOPWORDSENGLISH and STOPWORDSSPANISH properties)
+        self.__stopwords_english = None
+        self.__stopwords_spanish = None
 
-        self.NLPENGLISH = spacy.load('en_core_web_lg')
-        self.NLPSPANISH = spacy.load('es_core_news_lg')
+        self.english_model = english_model
+        self.spanish_model = spanish_model
+        self.mmap_mode = mmap_mode
+        self.metrics = metrics
+        self.cache = cache
+        if cache is not None and cache.metrics is None:
+            cache.metrics = metrics
         self.PUNTUACTION = string.punctuation
-        self.PATHMODEL = pkg_resources.resource_filename(__name__,"weights/mood.joblib")
+        self.PATHMODEL = str(resources.files(__package__) / "weights" / "mood.joblib")
+
+        # corpus topic model (see fit_topic_corpus)
+        self.topic_vectorizer = None
+        self.topic_model = None
+        self.topic_lang = None
+        # number of lyrics the corpus topic model was trained with, used to weight the updates
+        self.topic_documents = 0
+
+    @property
+    def STOPWORDSENGLISH(self):
+        if self.__stopwords_english is None:
+            from spacy.lang.en.stop_words import STOP_WORDS
+            self.__stopwords_english = list(STOP_WORDS)
+        return self.__stopwords_english
+
+    @STOPWORDSENGLISH.setter
+    def STOPWORDSENGLISH(self,stopwords):
+        self.__stopwords_english = stopwords
+
+    @property
+    def STOPWORDSSPANISH(self):
+        if self.__stopwords_spanish is None:
+            from spacy.lang.es.stop_words import STOP_WORDS
+            self.__stopwords_spanish = list(STOP_WORDS)
+        return self.__stopwords_spanish
+
+    @STOPWORDSSPANISH.setter
+    def STOPWORDSSPANISH(self,stopwords):
+        self.__stopwords_spanish = stopwords
+
+    @property
+    def NLPENGLISH(self):
+        return _load_pipeline(self.english_model)
+
+    @property
+    def NLPSPANISH(self):
+        return _load_pipeline(self.spanish_model)
 
     #----------------
     # TOPIC MODELLING
@@ -58,83 +268,106 @@ class SpotiSciencePredicter():
         lyric_list = [sentence for sentence in lyric_list if len(sentence)>1]
         return lyric_list
 
-    def __inner__spacy_tokenizer(self,lyric,lang):
+    def __inner__spacy_tokenizer(self,sentences,lang,batch_size=256,n_process=1):
         """
-        Return a list with tokenize sentece of lyric list
+        Return an iterator with the tokenized sentences of lyric list (one string of lemmas per sentence)
+        The sentences are streamed through the spacy pipeline in batches
         Attributes
         ----------
-        lyric: str - the lyric of the song
+        sentences: iterable - the sentences of the lyrics
         lang: the lenguage model used for tokenize (available are spanish and english)
+        batch_size: int - number of sentences processed per spacy batch
+        n_process: int - number of processes used by spacy
         """
         if "english" in lang:
-            mytokens = self.NLPENGLISH(lyric)
-            mytokens = [ word.lemma_.lower() if word.lemma_ != "-PRON-" else word.lower_ for word in mytokens]
-            mytokens = [ word for word in mytokens if word not in self.STOPWORDSENGLISH and word not in self.PUNTUACTION] 
+            nlp = self.NLPENGLISH
+            stopwords = set(self.STOPWORDSENGLISH)
         if "spanish" in lang:
-            mytokens = self.NLPSPANISH(lyric)
-            mytokens = [ word.lemma_.lower() if word.lemma_ != "-PRON-" else word.lower_ for word in mytokens]
-            mytokens = [ word for word in mytokens if word not in self.STOPWORDSSPANISH and word not in self.PUNTUACTION] 
-        
-        mytokens = " ".join([i for i in mytokens])
-        return mytokens
+            nlp = self.NLPSPANISH
+            stopwords = set(self.STOPWORDSSPANISH)
+
+        for doc in nlp.pipe(sentences,batch_size=batch_size,n_process=n_process):
+            mytokens = [ word.lemma_.lower() if word.lemma_ != "-PRON-" else word.lower_ for word in doc]
+            mytokens = [ word for word in mytokens if word not in stopwords and word not in self.PUNTUACTION] 
+            yield " ".join(mytokens)
 
-    def __inner__lyric_vectorizer(self,lyrics,stop_words,n_grams):
+    def __inner__tokens_keys(self,lyrics,lang):
         """
-        vectorize the lyrics returning the vectorizer object and a list with the vectorized lyrics
+        Return the cache keys of the tokenized lyrics, the sha256 of the language, the spacy model name and version, the stop words, the punctuation and the lyric
         Attributes
         ----------
-        lyrics: list - a list with sentences of lyric.
-        stop_words: str - the language used for vectorizer stop words 
-        n_grams: tuple - the number of n-grams used for vectorizer  model  (1gram: (1,1) ,  1 or 2 gram (1,2))
-
-        see more info about stop_words and n_grams parameters in sklearn documentation
-        https://scikit-learn.org/stable/modules/generated/sklearn.feature_extraction.text.CountVectorizer.html
+        lyrics: [str,str,...] - the lyrics of the songs
+        lang: the lenguage model used for tokenize (available are spanish and english)
         """
-        vectorizer = CountVectorizer(min_df=1, max_df=0.9, stop_words=stop_words, token_pattern='[a-zA-Z\-][a-zA-Z\-]{2,}',ngram_range=n_grams)
-        lyrics_vectorized = vectorizer.fit_transform(lyrics)
-        return vectorizer,lyrics_vectorized
+        if "english" in lang:
+            model = self.english_model
+            stopwords = self.STOPWORDSENGLISH
+        if "spanish" in lang:
+            model = self.spanish_model
+            stopwords = self.STOPWORDSSPANISH
+
+        prefix = hashlib.sha256(json.dumps([lang,model,_pipeline_version(model),sorted(stopwords),self.PUNTUACTION]).encode('utf-8'))
+        KEYS = []
+        for lyric in lyrics:
+            key = prefix.copy()
+            key.update(lyric.encode('utf-8'))
+            KEYS.append(key.hexdigest())
+        return KEYS
 
-    def __train__model(self,lyrics_vectorized,modelname,num_topics):
+    def __inner__tokenize_lyrics(self,lyrics,lang,batch_size=256,n_process=1):
         """
-        train the topic modelling model
+        Return an iterator with the list of tokenized sentences of every lyric, the sentences of all the lyrics are tokenized in one streamed pass
+        With a cache, the lyrics already tokenized are read from it and only the new ones go through spacy
         Attributes
         ----------
-        lyrics_vectorized: list -  the song lyrics vectorized 
-        modelname: str - the name of the model used for Topic MOdelling (available options are "lda","nmf" and "lsi")
-        num_topics: int - the number of topics for the model 
+        lyrics: [str,str,...] - the lyrics of the songs
+        lang: the lenguage model used for tokenize (available are spanish and english)
+        batch_size: int - number of sentences processed per spacy batch
+        n_process: int - number of processes used by spacy
         """
-    
-        if "lda" in modelname:
-            # Latent Dirichlet Allocation Model
-            model = LatentDirichletAllocation(n_components=num_topics, max_iter=10, learning_method='online',verbose=False)
-        if "nmf" in modelname:
-        # Non-Negative Matrix Factorization Model
-            model = NMF(n_components=num_topics)
-        if "lsi" in modelname:
-            # Latent Semantic Indexing Model using Truncated SVD
-            model = TruncatedSVD(n_components=num_topics)
-        model.fit(lyrics_vectorized)
-        return model 
+        if self.cache is None:
+            lyric_lists = [self.__inner__lyric_to_list(lyric) for lyric in lyrics]
+            sentences = (sentence for lyric_list in lyric_lists for sentence in lyric_list)
+            processed = self.__inner__spacy_tokenizer(sentences,lang=lang,batch_size=batch_size,n_process=n_process)
+            processed_lyrics = (list(islice(processed,len(lyric_list))) for lyric_list in lyric_lists)
+        else:
+            processed_lyrics = self.__inner__cached_tokenize_lyrics(lyrics,lang,batch_size=batch_size,n_process=n_process)
+        if self.metrics is not None:
+            processed_lyrics = self.metrics.timed(processed_lyrics,'stage_seconds',stage='tokenize')
+        yield from processed_lyrics
 
-    def __inner__selected_topics(self,model, vectorizer, top_n):
+    def __inner__cached_tokenize_lyrics(self,lyrics,lang,batch_size=256,n_process=1):
         """
-        Predict the topics using vectorizer model and topic modelling model 
-        Attributes
-        ----------
-        model: object - the trained topic modelling model
-        vectorizer: object -  the trained vectorizer model 
-        top_n: int - the max number of words per topic
+        Return an iterator with the list of tokenized sentences of every lyric reading the lyrics already tokenized from the cache (see __inner__tokenize_lyrics)
+        The new lyrics are tokenized once even if they are repeated and stored in the cache in batches
         """
-        RESULTS = defaultdict(list)
-        for idx, topic in enumerate(model.components_):
-            n_topic = "Topic %d:" % (idx)
-            topics = [(vectorizer.get_feature_names()[i], topic[i])
-                            for i in topic.argsort()[:-top_n - 1:-1]]
-            
-            RESULTS[n_topic].append(topics)
-        return RESULTS
+        lyrics = list(lyrics)
+        keys = self.__inner__tokens_keys(lyrics,lang)
+        CACHED = self.cache.get_many('tokens',keys)
+
+        # the lyrics not cached, in order of first appearance, are tokenized in one streamed pass
+        missing = {}
+        for key,lyric in zip(keys,lyrics):
+            if key not in CACHED and key not in missing:
+                missing[key] = self.__inner__lyric_to_list(lyric)
+        sentences = (sentence for lyric_list in missing.values() for sentence in lyric_list)
+        processed = self.__inner__spacy_tokenizer(sentences,lang=lang,batch_size=batch_size,n_process=n_process)
 
-    def predict_topic_lyric(self,lyric,model='lda',lang='english',stopwords=None,n_grams=(1,1),n_topics=1,top_n=10):
+        NEW = {}
+        try:
+            for key in keys:
+                if key not in CACHED:
+                    CACHED[key] = NEW[key] = list(islice(processed,len(missing[key])))
+                    if len(NEW) >= 1000:
+                        self.cache.put_many('tokens',NEW)
+                        NEW = {}
+                yield CACHED[key]
+        finally:
+            # the lyrics tokenized before the iterator is closed are kept too
+            if NEW:
+                self.cache.put_many('tokens',NEW)
+
+    def predict_topic_lyric(self,lyric,model='lda',lang='english',stopwords=None,n_grams=(1,1),n_topics=1,top_n=10,batch_size=256,n_process=1):
         """
         main method used to predict the topics of lyrics 
         Attributes
@@ -146,6 +379,8 @@ class SpotiSciencePredicter():
         n_grams: tuple - the number of n-grams used for vectorizer  model  (1gram: (1,1) ,  1 or 2 gram (1,2)) (default is (1,1))
         n_topics: int - the number of topics for the model  (default is 10)
         top_n: int - the max number of words per topic
+        batch_size: int - number of sentences processed per spacy batch (default is 256)
+        n_process: int - number of processes used by spacy to tokenize (default is 1)
 
         to see more info about models and vectorizer attributes
         https://scikit-learn.org/stable/modules/generated/sklearn.feature_extraction.text.CountVectorizer.html
@@ -153,12 +388,144 @@ class SpotiSciencePredicter():
         https://scikit-learn.org/stable/auto_examples/applications/plot_topics_extraction_with_nmf_lda.html
         https://scikit-learn.org/stable/modules/generated/sklearn.decomposition.TruncatedSVD.html
         """
-        lyric_list = self.__inner__lyric_to_list(lyric)
-        processed_lyric = [self.__inner__spacy_tokenizer(lyric=sentence,lang=lang) for sentence in lyric_list]
-        vectorizer, data_vectorized = self.__inner__lyric_vectorizer(processed_lyric,stop_words=stopwords,n_grams=n_grams)
-        trained_model = self.__train__model(data_vectorized,modelname=model,num_topics=n_topics)
-        topics = self.__inner__selected_topics(trained_model,vectorizer,top_n=top_n)
-        return topics
+        return self.predict_topic_lyrics([lyric],model=model,lang=lang,stopwords=stopwords,n_grams=n_grams,n_topics=n_topics,top_n=top_n,batch_size=batch_size,n_process=n_process)[0]
+
+    def predict_topic_lyrics(self,lyrics,model='lda',lang='english',stopwords=None,n_grams=(1,1),n_topics=1,top_n=10,batch_size=256,n_process=1,n_jobs=1):
+        """
+        main method used to predict the topics of many lyrics, the sentences of all the lyrics are tokenized in one streamed pass
+        and the topic model of every lyric is trained in a pool of n_jobs processes
+        Return a list with the topics of every lyric (same order as the input)
+        Attributes
+        ----------
+        lyrics: [str,str,...] - the lyrics of the songs
+        model, lang, stopwords, n_grams, n_topics, top_n, batch_size, n_process, n_jobs - same as predict_topic_lyric
+        """
+        processed_lyrics = self.__inner__tokenize_lyrics(lyrics,lang=lang,batch_size=batch_size,n_process=n_process)
+        lyric_topics = partial(_lyric_topics,model=model,stopwords=stopwords,n_grams=n_grams,n_topics=n_topics,top_n=top_n)
+
+        if n_jobs <= 1:
+            results = [lyric_topics(processed_lyric) for processed_lyric in processed_lyrics]
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                results = list(executor.map(lyric_topics,processed_lyrics,chunksize=16))
+
+        if self.metrics is not None:
+            for _,stages in results:
+                for stage,seconds in stages.items():
+                    self.metrics.observe('stage_seconds',seconds,stage=stage)
+        return [topics for topics,_ in results]
+
+
+    def __inner__corpus_documents(self,lyrics,lang,batch_size=256,n_process=1):
+        """
+        Return a list with one document of tokenized sentences per lyric, used by the corpus topic model
+        """
+        return [" ".join(processed_lyric) for processed_lyric in self.__inner__tokenize_lyrics(lyrics,lang=lang,batch_size=batch_size,n_process=n_process)]
+
+    def fit_topic_corpus(self,lyrics,model='lda',lang='english',stopwords=None,n_grams=(1,1),n_topics=10,min_df=1,max_df=0.9,batch_size=256,n_process=1):
+        """
+        main method used to train a topic model over a corpus of lyrics (one document per song), so the topics of different songs can be compared
+        The trained vectorizer and model are kept in the predicter (topic_vectorizer and topic_model attributes)
+        Attributes
+        ----------
+        lyrics: [str,str,...] - the lyrics of the songs of the corpus
+        model, lang, stopwords, n_grams, n_topics, batch_size, n_process - same as predict_topic_lyric
+        min_df, max_df: int or float - the min and max document frequency of the vectorizer words (default is 1 and 0.9)
+        """
+        documents = self.__inner__corpus_documents(lyrics,lang=lang,batch_size=batch_size,n_process=n_process)
+        with timer(self.metrics,'stage_seconds',stage='vectorize'):
+            self.topic_vectorizer, data_vectorized = _lyric_vectorizer(documents,stop_words=stopwords,n_grams=n_grams,min_df=min_df,max_df=max_df)
+        with timer(self.metrics,'stage_seconds',stage='fit'):
+            self.topic_model = _train_model(data_vectorized,modelname=model,num_topics=n_topics)
+        self.topic_lang = lang
+        self.topic_documents = data_vectorized.shape[0]
+        return self
+
+    def update_topic_corpus(self,lyrics,batch_size=256,n_process=1):
+        """
+        main method used to update the corpus topic model with new lyrics (only available for the lda model)
+        The vocabulary of the vectorizer is kept, words not seen when the corpus was fitted are ignored.
+        The new lyrics are weighted by the number of lyrics seen so far, so a small update does not replace the topics of the corpus
+        Attributes
+        ----------
+        lyrics: [str,str,...] - the lyrics of the new songs
+        batch_size, n_process - same as predict_topic_lyric
+        """
+        if not hasattr(self.topic_model,'partial_fit'):
+            raise ValueError("only the lda corpus topic model can be updated, fit the corpus again to use new lyrics")
+        documents = self.__inner__corpus_documents(lyrics,lang=self.topic_lang,batch_size=batch_size,n_process=n_process)
+        with timer(self.metrics,'stage_seconds',stage='vectorize'):
+            data_vectorized = self.topic_vectorizer.transform(documents)
+        self.topic_documents += data_vectorized.shape[0]
+        with timer(self.metrics,'stage_seconds',stage='fit'):
+            # partial_fit scales every batch to total_samples documents (one million by default)
+            self.topic_model.total_samples = self.topic_documents
+            self.topic_model.partial_fit(data_vectorized)
+        return self
+
+    def save_topic_corpus(self,path):
+        """
+        Save the corpus vectorizer and topic model in a joblib file
+        Attributes
+        ----------
+        path: str - the path of the joblib file
+        """
+        import joblib
+
+        joblib.dump({'vectorizer':self.topic_vectorizer,'model':self.topic_model,'lang':self.topic_lang,'documents':self.topic_documents},path)
+
+    def load_topic_corpus(self,path):
+        """
+        Load the corpus vectorizer and topic model saved with save_topic_corpus
+        Attributes
+        ----------
+        path: str - the path of the joblib file
+        """
+        import joblib
+
+        artifacts = joblib.load(path)
+        self.topic_vectorizer = artifacts['vectorizer']
+        self.topic_model = artifacts['model']
+        self.topic_lang = artifacts['lang']
+        # files saved before the number of lyrics was kept count as an empty corpus
+        self.topic_documents = artifacts.get('documents',0)
+        return self
+
+    def get_corpus_topics(self,top_n=10):
+        """
+        Return the top words of every topic of the corpus topic model
+        Attributes
+        ----------
+        top_n: int - the max number of words per topic
+        """
+        return _selected_topics(self.topic_model,self.topic_vectorizer,top_n=top_n)
+
+    def predict_corpus_topic(self,lyric,batch_size=256,n_process=1):
+        """
+        main method used to score the topics of a lyric with the corpus topic model, without training a model
+        Return a dictionary with the weight of every corpus topic
+        Attributes
+        ----------
+        lyric: str - the lyrics of the song
+        batch_size, n_process - same as predict_topic_lyric
+        """
+        return self.predict_corpus_topics([lyric],batch_size=batch_size,n_process=n_process)[0]
+
+    def predict_corpus_topics(self,lyrics,batch_size=256,n_process=1):
+        """
+        main method used to score the topics of many lyrics with the corpus topic model
+        Return a list with the topic weights dictionary of every lyric (same order as the input)
+        Attributes
+        ----------
+        lyrics: [str,str,...] - the lyrics of the songs
+        batch_size, n_process - same as predict_topic_lyric
+        """
+        documents = self.__inner__corpus_documents(lyrics,lang=self.topic_lang,batch_size=batch_size,n_process=n_process)
+        with timer(self.metrics,'stage_seconds',stage='vectorize'):
+            data_vectorized = self.topic_vectorizer.transform(documents)
+        with timer(self.metrics,'stage_seconds',stage='transform'):
+            weights = self.topic_model.transform(data_vectorized)
+        return [{"Topic %d:" % (idx):float(weight) for idx,weight in enumerate(row)} for row in weights]
 
 
     #---------------
@@ -170,56 +537,86 @@ class SpotiSciencePredicter():
         main method used to predict the mood of a song 
         Attributes
         ----------
-        song: dict - the data of the song 
+        song: dict - the data of the song (or a row of a songs table), for a songs table the list of moods of its songs is returned (see predict_song_moods)
         """
-        predictmodel = joblib.load(self.PATHMODEL)
+        if is_table(song):
+            return self.predict_song_moods(song)
+        return self.predict_song_moods(as_collection(song) if is_row(song) else [song])[0]
+
+    def predict_song_moods(self,songs,proba=False):
+        """
+        main method used to predict the mood of many songs in a single call to the model
+        Return a list with the mood of every song (same order as the input)
+        Attributes
+        ----------
+        songs: [dict,dict,...] - the data of the songs (a list of songs, the output of the album and playlist downloaders or a songs table)
+        proba: boolean - If True, return a dictionary with the probability of every mood instead of the mood (default is False)
+        """
+        predictmodel = _load_model(self.PATHMODEL,mmap_mode=self.mmap_mode)
         moods = {0:'calm',1:'energy',2:'happy',3:'sad'}
-        song_features = np.array(list(song.values())[6:]).reshape(-1,1).T
-        
+        song_features = feature_matrix(as_collection(songs),SONG_KEYS[6:])
+        if len(song_features) == 0:
+            return []
+
+        if proba:
+            probas = predictmodel.predict_proba(song_features)
+            return [{moods[label]:float(p) for label,p in zip(predictmodel.classes_,row)} for row in probas]
+
         preds = predictmodel.predict(song_features)
-        return moods[preds[0]]
+        return [moods[pred] for pred in preds]
         
     #---------------
     #Song Similarity
     #---------------
-    def predict_similar_songs(self,object,target,distance='l2',n_features=6,top_n=10):
+    def predict_similar_songs(self,object,target,distance='l2',n_features=6,top_n=10,chunk_size=65536):
         """
         main method used to calculate most similar songs
         Attributes
         ----------
-        object: str - the id or copy link of the song to analyze
-        target: str - the id or copy of the object to search for similar songs (availabel objects are: song or album or playlist)
+        object: dict [dict,dict,...] - the data of the song to analyze (it could be a single song, a list of songs or a songs table)
+        target: dict - the data of the songs where to search for similar songs (output of the song, album or playlist downloaders or a songs table)
+                       or a SimilarityIndex prebuilt with the songs (n_features and chunk_size are then taken from the index)
         distance: str - the type of distance used to predict similar words (available type are l1 or l2, default is l2)
-        n_features: int - number of features of song used to predict similarity (default is 6)
+        n_features: int - position of the first song key used as feature to predict similarity (default is 6)
                          - model is training with the following features [acousticness, length,danceability, energy, instrumentalness,liveness,valence,loudness,speechiness,tempo,key,time_signature]
         top_n: int - number of most similar songs returns as result (default is 10)
+        chunk_size: int - max number of target songs compared at once, it bounds the memory used for large targets (default is 65536)
 
         for more information about features go to spotify song features
         https://developer.spotify.com/documentation/web-api/reference/#category-tracks
         """
-        similarity = []
+        if isinstance(target,SimilarityIndex):
+            return target.query(object,distance=distance,top_n=top_n)
+
         similar_songs = defaultdict(list)
 
-        object_feature = list(object.values())[n_features:]
-        object_name = list(object.values())[1]
-
-        for key in target.keys():
-            for song in target[key]:
-                target_feature = list(song.values())[n_features:]
-                target_name = list(song.values())[1]
-                target_artist = list(song.values())[2]
-
-                if object_name not in target_name:
-                    object_feature = np.array([float(i)/sum(object_feature) for i in object_feature])
-                    target_feature = np.array([float(i)/sum(target_feature) for i in target_feature])
-                    if "l2" in distance:
-                        n_similarity = np.linalg.norm(object_feature-target_feature)
-                    if "l1" in distance: 
-                        n_similarity = np.linalg.norm(object_feature-target_feature,ord=1)
-                    results = (target_name,target_artist,n_similarity)
-                    similarity.append(results)
-                    similarity = sorted(similarity ,key =lambda tup:tup[2])
-                    similarity = [tup for tup in similarity if tup[2]>0]
-
-            similar_songs[object_name] = similarity[0:top_n]
-        return similar_songs
\ No newline at end of file
+        objects = as_collection(object)
+        keys = SONG_KEYS[n_features:]
+        object_names = column(objects,'name')
+        queries = normalize(feature_matrix(objects,keys))
+
+        best_dist = np.empty((len(objects),0))
+        best_idx = np.empty((len(objects),0),dtype=np.int64)
+        candidates = {}
+        offset = 0
+
+        # the distances of every query are computed at once, so the chunk is shared between the queries
+        for chunk in iter_chunks(target,max(1,chunk_size//max(1,len(objects)))):
+            chunk_names = column(chunk,'name')
+            block = normalize(feature_matrix(chunk,keys))
+            dist = distances(queries,block,distance)
+
+            # songs identical to the object and songs named like the object (only checked for the nearest songs) are not similar songs
+            dist[~(dist > 0)] = np.inf
+            dist = exclude_names(dist,object_names,chunk_names,top_n)
+
+            best_dist,best_idx = merge_top_n(best_dist,best_idx,dist,np.arange(offset,offset+len(chunk)),top_n)
+
+            # keep only the names of the current candidates so memory does not grow with the target
+            candidates.update(enumerate(zip(chunk_names,column(chunk,'artist')),start=offset))
+            candidates = {i:candidates[i] for i in best_idx[np.isfinite(best_dist)].tolist()}
+            offset += len(chunk)
+
+        for n,name in enumerate(object_names):
+            similar_songs[name] = [candidates[i]+(float(d),) for d,i in zip(best_dist[n],best_idx[n]) if np.isfinite(d)]
+        return similar_songs
@@ -0,0 +1,58 @@
+"""
+This module implements the request rate limiting shared by the workers of the downloader
+Author: Cristóbal Veas
+Linkedln: https://www.linkedin.com/in/cristobal-veas/
+"""
+
+__author__ = "Cristóbal Veas"
+__email__ = "cristobal.veas.ch@gmail.com"
+__status__ = "planning"
+
+import threading
+import time
+
+
+class TokenBucket():
+    """
+    Thread-safe token bucket limiter.
+    Attributes
+    ----------
+    rate: float - number of tokens added per second (max sustained requests per second)
+    capacity: int - max number of tokens stored, that is the max burst of requests (default is the rate)
+    """
+
+    def __init__(self,rate,capacity=None):
+        self.rate = float(rate)
+        self.capacity = capacity if capacity is not None else max(1,int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a token is available and take it, returning the seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity,self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = max(self.blocked_until - now,(1 - self.tokens) / self.rate)
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self,seconds):
+        """
+        Stop handing out tokens to every worker during the given seconds (used to honor the Retry-After header)
+        Attributes
+        ----------
+        seconds: float - the seconds to wait before the next request
+        """
+        with self.lock:
+            self.blocked_until = max(self.blocked_until,time.monotonic() + seconds)
+            self.tokens = 0.0
@@ -0,0 +1,95 @@
+"""
+Tests of the similar songs search against the original one-song-at-a-time algorithm
+"""
+
+from collections import defaultdict
+import random
+import numpy as np
+import pytest
+from spotiscience.features import SONG_KEYS
+from spotiscience.prediction import SpotiSciencePredicter
+
+
+def baseline_similar_songs(object,target,distance='l2',n_features=6,top_n=10):
+    """
+    The original predict_similar_songs, songs at the same distance keep the order of the target
+    """
+    similarity = []
+    object_feature = list(object.values())[n_features:]
+    object_name = list(object.values())[1]
+    for song in target:
+        target_feature = list(song.values())[n_features:]
+        target_name = list(song.values())[1]
+        if object_name not in target_name:
+            object_feature = np.array([float(i)/sum(object_feature) for i in object_feature])
+            target_feature = np.array([float(i)/sum(target_feature) for i in target_feature])
+            if "l2" in distance:
+                n_similarity = np.linalg.norm(object_feature-target_feature)
+            if "l1" in distance:
+                n_similarity = np.linalg.norm(object_feature-target_feature,ord=1)
+            similarity.append((target_name,list(song.values())[2],n_similarity))
+    similarity = sorted(similarity,key=lambda tup:tup[2])
+    return [tup for tup in similarity if tup[2]>0][0:top_n]
+
+
+def random_song(rng,n):
+    song = dict.fromkeys(SONG_KEYS)
+    song.update(id=str(n),name=f"S{n}",artist=f"A{n}",album="Album",release_date="2020",popularity=rng.randint(0,100),length=rng.randint(120000,360000))
+    for key in SONG_KEYS[7:]:
+        song[key] = rng.random()
+    song['key'] = rng.randint(0,11)
+    song['time_signature'] = 4
+    return song
+
+
+@pytest.fixture(scope='module')
+def duplicated_target():
+    """
+    50 copies of 20 songs, like the re-releases of a catalog, so most of the songs are tied with others
+    """
+    rng = random.Random(0)
+    songs = [random_song(rng,n) for n in range(20)]
+    target = []
+    for n in range(1000):
+        song = dict(songs[n % 20])
+        song.update(id=str(n),name=f"S{n}",artist=f"A{n}")
+        target.append(song)
+    query = random_song(rng,-1)
+    query['name'] = "Query"
+    return query,target
+
+
+@pytest.mark.parametrize('distance',['l1','l2'])
+@pytest.mark.parametrize('top_n',[1,10,25])
+@pytest.mark.parametrize('chunk_size',[7,64,333,1000,5000])
+def test_ties_match_baseline(duplicated_target,distance,top_n,chunk_size):
+    query,target = duplicated_target
+    expected = baseline_similar_songs(query,target,distance=distance,top_n=top_n)
+    result = SpotiSciencePredicter().predict_similar_songs(query,{'songs':target},distance=distance,top_n=top_n,chunk_size=chunk_size)['Query']
+    assert [song[:2] for song in result] == [song[:2] for song in expected]
+    assert np.allclose([song[2] for song in result],[song[2] for song in expected])
+
+
+def test_table_row_is_one_song(duplicated_target):
+    import pandas as pd
+    from spotiscience.features import SONG_DTYPES
+
+    query,target = duplicated_target
+    table = pd.DataFrame([query]+target,columns=SONG_KEYS).astype(SONG_DTYPES)
+    predicter = SpotiSciencePredicter()
+    assert predicter.predict_similar_songs(table.iloc[0],table) == predicter.predict_similar_songs(table.iloc[[0]],table)
+
+
+@pytest.mark.parametrize('distance',['l1','l2'])
+def test_index_matches_predict_similar_songs(tmp_path,distance):
+    from spotiscience.index import SimilarityIndex
+
+    rng = random.Random(1)
+    target = [random_song(rng,n) for n in range(5000)]
+    queries = [random_song(rng,-n) for n in range(1,11)]
+    index = SimilarityIndex.build(str(tmp_path),target,block_size=512)
+    expected = SpotiSciencePredicter().predict_similar_songs(queries,{'songs':target},distance=distance,top_n=10)
+    result = index.query(queries,distance=distance,top_n=10)
+    for name,songs in expected.items():
+        assert [song[:2] for song in result[name]] == [song[:2] for song in songs]
+        assert np.allclose([song[2] for song in result[name]],[song[2] for song in songs],rtol=1e-12)